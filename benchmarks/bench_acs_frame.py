@@ -0,0 +1,98 @@
+# compare the old per-row censusgeo loop + DataFrame.append with
+# uni_rd.acs.build_acs_panel at county, tract and block group row counts
+#
+#     python benchmarks/bench_acs_frame.py
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from uni_rd import acs  # noqa: E402
+
+column_map = {'B05002_001E': 'total_population',
+              'B05002_013E': 'total_foreign_born'}
+
+# rows per year for each geography level
+scales = {'county': 3221, 'tract': 85000, 'block group': 240000}
+years = [2010, 2011, 2012]
+
+
+# a raw download shaped like census.download output
+def synthetic_download(n, level):
+    rng = np.random.default_rng(n)
+    state = np.char.zfill(rng.integers(1, 57, n).astype(str), 2)
+    county = np.char.zfill(rng.integers(1, 300, n).astype(str), 3)
+    name = np.char.add(np.char.add('Some County, State ', state), '')
+    data = {'NAME': name}
+    for var in column_map:
+        data[var] = rng.integers(0, 100000, n)
+    data['state'] = state
+    data['county'] = county
+    if level in ('tract', 'block group'):
+        data['NAME'] = np.char.add('Census Tract 1, ', name)
+        data['tract'] = np.char.zfill(rng.integers(100, 999999, n)
+                                      .astype(str), 6)
+    if level == 'block group':
+        data['block group'] = rng.integers(1, 9, n).astype(str)
+
+    return pd.DataFrame(data)
+
+
+# the loop the script used before, kept here only as the baseline
+def legacy_frame(data, year):
+    new_indices, county_names, state_names = [], [], []
+    county_ids, state_ids = [], []
+    for name, state_id, county_id in zip(data['NAME'], data['state'],
+                                         data['county']):
+        new_indices.append(state_id + county_id)
+        county_names.append(name.split(',')[0])
+        state_names.append(name.split(',')[1])
+        state_ids.append(state_id)
+        county_ids.append(county_id)
+    data = data.copy()
+    data['COUNTYFIPS'] = new_indices
+    data['county'] = county_names
+    data['state'] = state_names
+    data['year'] = year
+    data['county_id'] = county_ids
+    data['state_id'] = state_ids
+    data = data[['year', 'state', 'county', 'county_id', 'state_id',
+                 'COUNTYFIPS', *column_map]].rename(column_map, axis=1)
+    data['state'] = data['state'].str.strip()
+
+    return data
+
+
+# DataFrame.append is gone in pandas 2, concat with the same
+# one-frame-at-a-time growth stands in for it
+def legacy_panel(downloads):
+    panel = pd.DataFrame()
+    for year in years:
+        panel = pd.concat([panel, legacy_frame(downloads[year], year)])
+
+    return panel.reset_index(drop=True)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+
+    return time.perf_counter() - start
+
+
+def main():
+    print(f'{"level":<12}{"rows":>10}{"legacy s":>12}{"builder s":>12}'
+          f'{"speedup":>10}')
+    for level, n in scales.items():
+        downloads = {year: synthetic_download(n, level) for year in years}
+        legacy = timed(legacy_panel, downloads)
+        builder = timed(acs.build_acs_panel, downloads, column_map, years)
+        print(f'{level:<12}{n * len(years):>10}{legacy:>12.3f}'
+              f'{builder:>12.3f}{legacy / builder:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
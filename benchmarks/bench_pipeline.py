@@ -0,0 +1,194 @@
+# time and memory of every pipeline stage over a grid of synthetic
+# scales (geographies x years x institutions), the census stage served by
+# a local FakeCensus. Each run is stored as benchmarks/results/<time>-
+# <commit>.json and compared with the previous one, so a slower stage
+# shows up between versions.
+#
+#     python benchmarks/bench_pipeline.py                  # default grid
+#     python benchmarks/bench_pipeline.py --grid quick
+#     python benchmarks/bench_pipeline.py --geographies 3000 80000 \
+#         --years 10 40 --institutions 50 1000
+#     python benchmarks/bench_pipeline.py --compare OLD.json NEW.json
+import argparse
+import glob
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# everything the pipeline caches goes to a throw-away directory
+os.environ.setdefault('UNI_RD_CACHE', tempfile.mkdtemp(prefix='uni_rd_'))
+sys.path.insert(0, root)
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+from statsmodels.formula.api import ols  # noqa: E402
+
+from benchmarks.synthetic import make_inputs  # noqa: E402
+from uni_rd import (acs, census, cube, exposure, herd,  # noqa: E402
+                    inference, instrument, regression, universities)
+
+results_dir = os.path.join(root, 'benchmarks', 'results')
+
+grids = {'quick': {'geographies': [3000], 'years': [10],
+                   'institutions': [50]},
+         'default': {'geographies': [3000, 20000, 80000], 'years': [10, 40],
+                     'institutions': [50, 1000]},
+         'full': {'geographies': [3000, 10000, 30000, 80000],
+                  'years': [10, 20, 40], 'institutions': [50, 200, 1000]}}
+
+
+def measure(func, *args, **kwargs):
+    with instrument.Measurement(func.__name__) as m:
+        output = m.output(func(*args, **kwargs))
+    numbers = m.to_dict()
+    growth = None  # memory is None without psutil
+    if numbers['peak_rss_mb'] is not None:
+        growth = round(numbers['peak_rss_mb'] - numbers['rss_start_mb'], 1)
+
+    return output, {'wall_s': numbers['wall_s'], 'cpu_s': numbers['cpu_s'],
+                    'peak_rss_mb': numbers['peak_rss_mb'],
+                    'rss_growth_mb': growth,
+                    'rows': numbers['output_rows'], **numbers['counters']}
+
+
+# the four outcome fits one formula OLS at a time, as the script did
+# before the single fixed-effects fit
+def ols_per_outcome(reg_data):
+    return {y: ols(f'{y} ~ fund + C(year)', data=reg_data).fit()
+            for y in regression.outcomes.values()}
+
+
+# every stage once on the inputs of one grid point
+def run_stages(inputs, reps):
+    fake = inputs['census']
+    census.CENSUS_API_URL = fake.url
+    census.default_cache().clear()
+    ystart, yend = inputs['ystart'], inputs['yend']
+    stages = {}
+
+    df, stages['census'] = measure(acs.get_county_df, ystart, yend)
+    _, stages['census_cached'] = measure(acs.get_county_df, ystart, yend)
+    uni_df, stages['herd'] = measure(herd.get_uni_fund, ystart, yend, None,
+                                     inputs['rank_by'], inputs['herd_file'])
+    lookup, stages['uni_counties'] = measure(universities.build_uni_lookup,
+                                             inputs['uni_shp'])
+    panel, stages['panel'] = measure(universities.get_regression_data,
+                                     uni_df, df, lookup)
+    _, stages['regression'] = measure(regression.get_regression_results,
+                                      panel)
+    _, stages['ols_per_outcome'] = measure(ols_per_outcome, panel)
+    _, stages['exposure'] = measure(exposure.get_fund_exposure, uni_df,
+                                    lookup)
+    _, stages['cube'] = measure(cube.get_panel_cube, uni_df, lookup, df)
+    if reps:
+        _, stages['inference'] = measure(inference.inference_table, panel,
+                                         list(regression.outcomes.values()),
+                                         reps=reps)
+
+    return stages
+
+
+def run_grid(grid, reps=20):
+    records = []
+    points = itertools.product(grid['geographies'], grid['years'],
+                               grid['institutions'])
+    for geographies, years, institutions in points:
+        scale = {'geographies': geographies, 'years': years,
+                 'institutions': institutions}
+        print(f'{scale} ...', file=sys.stderr)
+        with tempfile.TemporaryDirectory() as tmp:
+            inputs = make_inputs(tmp, geographies, years, institutions)
+            with inputs['census']:
+                stages = run_stages(inputs, reps)
+        for stage, numbers in stages.items():
+            records.append({**scale, 'stage': stage, **numbers})
+
+    return records
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=root, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def save_results(records, grid):
+    commit = git_commit()
+    stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime())
+    result = {'commit': commit, 'time': stamp,
+              'python': platform.python_version(),
+              'pandas': pd.__version__, 'numpy': np.__version__,
+              'cpus': os.cpu_count(), 'grid': grid, 'records': records}
+    os.makedirs(results_dir, exist_ok=True)
+    fname = os.path.join(results_dir, f'{stamp}-{commit}.json')
+    with open(fname, 'w') as f:
+        json.dump(result, f, indent=1)
+
+    return fname
+
+
+def load_records(fname):
+    with open(fname) as f:
+        return pd.DataFrame(json.load(f)['records'])
+
+
+# wall time and peak memory of new against old for every stage and scale
+# both runs measured; ratio > 1 is slower
+def compare(old, new):
+    keys = ['geographies', 'years', 'institutions', 'stage']
+    merged = load_records(old).merge(load_records(new), on=keys,
+                                     suffixes=('_old', '_new'))
+    merged['wall_ratio'] = merged['wall_s_new'] / merged['wall_s_old']
+    merged['rss_ratio'] = (merged['peak_rss_mb_new'].astype(float)
+                           / merged['peak_rss_mb_old'].astype(float))
+
+    return merged[keys + ['wall_s_old', 'wall_s_new', 'wall_ratio',
+                          'peak_rss_mb_old', 'peak_rss_mb_new',
+                          'rss_ratio']]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='time and memory of every stage over a scale grid')
+    parser.add_argument('--grid', choices=grids, default='default')
+    parser.add_argument('--geographies', type=int, nargs='+')
+    parser.add_argument('--years', type=int, nargs='+')
+    parser.add_argument('--institutions', type=int, nargs='+')
+    parser.add_argument('--reps', type=int, default=20,
+                        help='inference replicates, 0 skips the stage')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+
+    pd.set_option('display.width', 160)
+    pd.set_option('display.max_rows', 500)
+    if args.compare:
+        print(compare(*args.compare).to_string(index=False))
+        return
+
+    grid = {name: getattr(args, name) or values
+            for name, values in grids[args.grid].items()}
+    previous = sorted(glob.glob(os.path.join(results_dir, '*.json')))
+    records = run_grid(grid, args.reps)
+    fname = save_results(records, grid)
+
+    table = pd.DataFrame(records)
+    print(table.to_string(index=False))
+    print(f'\nsaved {fname}')
+    if previous:
+        changes = compare(previous[-1], fname)
+        if len(changes):
+            print(f'\ncompared with {os.path.basename(previous[-1])}:')
+            print(changes.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# census.download end to end against a local FakeCensus, no network: the
+# online path (fetched once, then answered from the cache) and the
+# offline path (served from the cache, CacheMiss for anything else).
+# Exits with an AssertionError on the first difference.
+#
+#     python benchmarks/check_census.py
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from uni_rd import census  # noqa: E402
+from uni_rd.fake_census import FakeCensus  # noqa: E402
+
+variables = ['B05002_001E', 'B19301_001E']
+geo = [('county', '*')]
+
+
+# first call fetches and stores, the same request again (variables in
+# another order) is a cache hit and sends nothing
+def check_online(api, cache):
+    frame = census.download('acs5', 2015, geo, variables, cache=cache,
+                            base_url=api.url)
+    assert api.requests == 1, api.requests
+    assert list(frame.columns) == ['NAME', *variables, 'state', 'county']
+    expected = len(api.states) * api.counties_per_state
+    assert len(frame) == expected, (len(frame), expected)
+    assert frame[variables].notna().all().all()
+    assert (cache.hits, cache.misses) == (0, 1), (cache.hits, cache.misses)
+
+    again = census.download('acs5', 2015, geo, variables[::-1],
+                            cache=cache, base_url=api.url)
+    assert api.requests == 1, api.requests
+    assert cache.hits == 1, cache.hits
+    assert again[variables].equals(frame[variables])
+
+    return frame
+
+
+# offline, the cached request comes back unchanged and an uncached one
+# raises CacheMiss, neither reaching the server
+def check_offline(api, directory, frame):
+    cache = census.CensusCache(directory, offline=True)
+    cached = census.download('acs5', 2015, geo, variables, cache=cache,
+                             base_url=api.url)
+    assert cached.equals(frame)
+
+    try:
+        census.download('acs5', 2016, geo, variables, cache=cache,
+                        base_url=api.url)
+    except census.CacheMiss:
+        pass
+    else:
+        raise AssertionError('offline download of an uncached year')
+    assert api.requests == 1, api.requests
+
+    # offline=False on the call wins over the cache, the miss is fetched
+    census.download('acs5', 2016, geo, variables, cache=cache,
+                    offline=False, base_url=api.url)
+    assert api.requests == 2, api.requests
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory, FakeCensus() as api:
+        frame = check_online(api, census.CensusCache(directory))
+        check_offline(api, directory, frame)
+    print('census download: online and offline ok')
+
+
+if __name__ == '__main__':
+    main()
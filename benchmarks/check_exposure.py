@@ -0,0 +1,66 @@
+# the fund exposure stage against the HERD file itself: a county under the
+# campus of an institution ranked below the top nuni still gets exposure,
+# since the stage takes every institution (herd_all), not the top nuni of
+# the regression panel. Exits with an AssertionError on a difference.
+#
+#     python benchmarks/check_exposure.py
+import os
+import sys
+import tempfile
+
+# the exposure weights are cached, here in a throw-away directory
+os.environ.setdefault('UNI_RD_CACHE', tempfile.mkdtemp(prefix='uni_rd_'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import geopandas as gpd  # noqa: E402
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from uni_rd import exposure, herd  # noqa: E402
+from uni_rd.config import county_shp  # noqa: E402
+from uni_rd.stages import STAGES, default_params  # noqa: E402
+
+ystart, yend = 2015, 2020
+
+
+# one campus, of the first institution past the top nuni with fund in
+# every year, on the centroid of a county; the rest are not located
+def campus_outside_top(nuni):
+    ranked = herd.get_all_fund(ystart, yend)
+    funded = ranked.groupby('IPEDSID', sort=False)['fund'].apply(
+        lambda fund: bool((fund > 0).all()))
+    ipedsid = funded.index[nuni:][funded.to_numpy()[nuni:]][0]
+
+    counties = gpd.read_file(county_shp, columns=['GEOID'], engine='pyogrio')
+    county = counties.iloc[[0]]
+    point = county.to_crs(exposure.projection).centroid.to_crs('EPSG:4326')
+    uni_lookup = pd.DataFrame({'IPEDSID': ranked['IPEDSID'].unique()})
+    uni_lookup['lon'] = np.where(uni_lookup['IPEDSID'] == ipedsid,
+                                 point.x.iloc[0], np.nan)
+    uni_lookup['lat'] = np.where(uni_lookup['IPEDSID'] == ipedsid,
+                                 point.y.iloc[0], np.nan)
+
+    return ranked, uni_lookup, county['GEOID'].iloc[0]
+
+
+def main():
+    stages = {stage.name: stage for stage in STAGES}
+    assert stages['exposure'].deps['uni_df'] == 'herd_all'
+    assert 'nuni' not in stages['herd_all'].params
+
+    nuni = default_params['nuni']
+    ranked, uni_lookup, fips = campus_outside_top(nuni)
+    result = exposure.get_fund_exposure(ranked, uni_lookup)
+    county = result[result['COUNTYFIPS'] == fips]
+    assert len(county) == yend - ystart, county
+    assert (county['fund_exposure'] > 0).all(), county
+
+    # the top nuni alone leave that county without exposure
+    top = herd.get_uni_fund(ystart, yend, nuni)
+    result = exposure.get_fund_exposure(top, uni_lookup)
+    assert (result['fund_exposure'] == 0).all()
+    print(f'fund exposure: campus ranked past the top {nuni} ok')
+
+
+if __name__ == '__main__':
+    main()
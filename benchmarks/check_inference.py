@@ -0,0 +1,41 @@
+# the resampling inference against fe_regression on a synthetic panel
+# with missing outcomes: the estimate before any replicate (weights of 1)
+# is the coefficient of the reported regression, each outcome on its own
+# complete rows, with year and with year + county fixed effects. Exits
+# with an AssertionError on a difference.
+#
+#     python benchmarks/check_inference.py
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from benchmarks.check_sweep import synthetic_panel  # noqa: E402
+from uni_rd import inference  # noqa: E402
+from uni_rd.fixed_effects import fe_regression  # noqa: E402
+from uni_rd.regression import outcomes  # noqa: E402
+
+
+def main():
+    panel, _ = synthetic_panel(n=200, located=200)
+    columns = list(outcomes.values())
+    for absorb in (['year'], ['year', 'COUNTYFIPS']):
+        design = inference.Design.from_frame(panel, columns, ['fund'],
+                                             absorb)
+        observed = inference.weighted_fit(design, design.x,
+                                          np.ones(len(design.y)))[0]
+        fit = fe_regression(panel, columns, ['fund'], absorb, 'IPEDSID')
+        expected = fit.params.loc['fund', columns].to_numpy()
+        assert np.allclose(observed, expected, rtol=1e-8, atol=0), \
+            (absorb, observed, expected)
+
+        table = inference.inference_table(panel, columns, absorb=absorb,
+                                          reps=20, workers=1)
+        assert np.allclose(table['coef'], expected, rtol=1e-8, atol=0)
+    print('inference: estimates equal fe_regression ok')
+
+
+if __name__ == '__main__':
+    main()
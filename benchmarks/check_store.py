@@ -0,0 +1,48 @@
+# the columnar store round trip on a throw-away directory: counts with a
+# missing value (a suppressed ACS estimate) come back as missing, the
+# others unchanged, and the codes keep their leading zeros. Exits with an
+# AssertionError on a difference.
+#
+#     python benchmarks/check_store.py
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from uni_rd import store  # noqa: E402
+
+
+def main():
+    df = pd.DataFrame({'year': [2015, 2015, 2016],
+                       'state': ['Alabama', 'Alabama', 'Illinois'],
+                       'county': ['Autauga County', 'Baldwin County',
+                                  'Cook County'],
+                       'county_id': [1, 3, 31], 'state_id': [1, 1, 17],
+                       'COUNTYFIPS': [1001, 1003, 17031],
+                       'income_past12m': [27000.5, np.nan, 35000.0]})
+    counts = [c for c in store.SCHEMAS['df_income_pop'].names
+              if c.startswith('total_')]
+    for i, column in enumerate(counts):
+        df[column] = [1000.0 + i, np.nan, 5000.0 + i]
+
+    with tempfile.TemporaryDirectory() as directory:
+        store.store_dir = directory
+        store.write_dataset(df, 'df_income_pop')
+        assert store.stored_years('df_income_pop') == [2015, 2016]
+        back = store.read_dataset('df_income_pop')
+
+    assert back['COUNTYFIPS'].tolist() == ['01001', '01003', '17031']
+    assert back['state_id'].tolist() == ['01', '01', '17']
+    for column in [*counts, 'income_past12m']:
+        assert back[column].isna().tolist() == [False, True, False], column
+        assert np.allclose(back[column].dropna(), df[column].dropna()), \
+            column
+    print('store: round trip with missing counts ok')
+
+
+if __name__ == '__main__':
+    main()
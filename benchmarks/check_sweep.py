@@ -0,0 +1,72 @@
+# the specification sweep on a synthetic panel: every specification it
+# returns is a different fit, no two give the same nobs and coef for an
+# outcome, whether the panel holds every institution or only the top
+# ones (a cutoff above those is then left out, not fitted again). Exits
+# with an AssertionError on a difference.
+#
+#     python benchmarks/check_sweep.py
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import us  # noqa: E402
+
+from uni_rd import sweep  # noqa: E402
+from uni_rd.regression import outcomes  # noqa: E402
+
+years = range(2010, 2020)
+
+
+# fund of n institutions from 2000 (the HERD file) and the county panel
+# of those located, one county each, with a few missing outcomes
+def synthetic_panel(n=400, located=300, seed=0):
+    rng = np.random.default_rng(seed)
+    ipedsids = np.arange(100000, 100000 + n)
+    fund = rng.lognormal(9, 1.5, n)
+    history = pd.DataFrame({
+        'year': np.repeat(np.arange(2000, 2020), n),
+        'IPEDSID': np.tile(ipedsids, 20),
+        'fund': np.tile(fund, 20) * rng.lognormal(0, 0.1, 20 * n)})
+
+    panel = history[history['year'].isin(years)
+                    & history['IPEDSID'].isin(ipedsids[:located])]
+    panel = panel.reset_index(drop=True)
+    states = np.array([s.fips for s in us.STATES_CONTIGUOUS])
+    county = dict(zip(ipedsids, np.char.add(
+        rng.choice(states, n),
+        np.char.zfill(rng.integers(1, 200, n).astype(str), 3))))
+    panel['COUNTYFIPS'] = panel['IPEDSID'].map(county)
+    for column in outcomes.values():
+        values = rng.lognormal(10, 1, len(panel)) + 0.01 * panel['fund']
+        panel[column] = np.where(rng.random(len(panel)) < 0.02, np.nan,
+                                 values)
+
+    return panel, history
+
+
+def check(panel, history):
+    table = sweep.run_sweep(panel, history=history, workers=1)
+    specs = table.drop_duplicates(['lag', 'transform', 'subsample', 'top_n'])
+    fits = table.drop_duplicates(['outcome', 'nobs', 'coef'])
+    assert len(fits) == len(table), (len(fits), len(table))
+
+    return table, len(specs)
+
+
+def main():
+    panel, history = synthetic_panel()
+    table, specs = check(panel, history)
+    assert set(table['top_n'].dropna()) == {50, 100, 200}
+
+    # the panel of the top 50 only: the larger cutoffs keep the same rows
+    top = sweep.fund_ranking(panel, history)[:50]
+    _, top_specs = check(panel[panel['IPEDSID'].isin(top)], history)
+    assert top_specs < specs, (top_specs, specs)
+    print(f'sweep: {specs} and {top_specs} distinct specifications ok')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# synthetic inputs at any scale for the pipeline benchmarks: a HERD
+# download (same layout as the NCSES file), a university shape file whose
+# campuses sit in real counties, and a FakeCensus that serves the ACS
+# tables for as many geographies as asked
+#
+#     inputs = make_inputs(tmpdir, geographies=20000, years=20,
+#                          institutions=200)
+#     with inputs['census'] as api: ...
+import csv
+import math
+import os
+import sys
+
+import geopandas as gpd
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from uni_rd.acs import us_contiguous  # noqa: E402
+from uni_rd.config import county_shp  # noqa: E402
+from uni_rd.fake_census import FakeCensus, state_list  # noqa: E402
+
+
+# HERD_data_IPEDS.csv look-alike: metadata block, '<Fiscal Year>' header
+# (latest year first), a state total row per state, then one row per
+# institution with '1,234' style thousands and '-' for missing years
+def write_herd(fname, ipedsids, states, years, seed=0):
+    rng = np.random.default_rng(seed)
+    years = sorted(years, reverse=True)
+    fund = rng.lognormal(9, 1.5, (len(ipedsids), len(years)))
+    missing = rng.random(fund.shape) < 0.05
+
+    lines = [['Data Download from NCSES Interactive Data Tool'], [],
+             ['Filters', 'Selected values'], ['Deflator: 2012 Dollars'],
+             ['Unit of Measure: Thousands of Dollars'], [],
+             ['', '<Fiscal Year>', *years],
+             ['', '<measures>', *['Total R&D'] * len(years)],
+             ['[State]', '[IPEDS UnitID]']]
+    for state in sorted(set(states)):
+        rows = [i for i, s in enumerate(states) if s == state]
+        total = np.where(missing[rows], 0, fund[rows]).sum(axis=0)
+        lines.append([state, 'Total for selected values',
+                      *[f'{v:,.0f}' for v in total]])
+        for i in rows:
+            lines.append([state, ipedsids[i],
+                          *['-' if m else f'{v:,.0f}'
+                            for v, m in zip(fund[i], missing[i])]])
+    lines += [[], ['NOTES:']]
+
+    # every line padded to the full width, as in the download
+    width = 2 + len(years)
+    with open(fname, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows(line + [''] * (width - len(line))
+                                for line in lines)
+
+
+# one campus per institution, placed inside a real county that the fake
+# census also serves; a tenth lose their COUNTYFIPS so the point in
+# polygon lookup has work to do
+def write_universities(fname, ipedsids, counties, seed=0):
+    rng = np.random.default_rng(seed)
+    pick = rng.integers(0, len(counties), len(ipedsids))
+    chosen = counties.iloc[pick]
+    fips = chosen['GEOID'].to_numpy().astype(object)
+    fips[rng.random(len(fips)) < 0.1] = None
+
+    campuses = gpd.GeoDataFrame(
+        {'IPEDSID': ipedsids,
+         'NAME': [f'University {i}' for i in ipedsids],
+         'COUNTYFIPS': fips},
+        geometry=chosen.geometry.representative_point().to_numpy(),
+        crs=counties.crs)
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    campuses.to_file(fname, engine='pyogrio')
+
+    return chosen['STATE_NAME'].to_numpy()
+
+
+# every input for one point of the scale grid, written under directory;
+# the census stand-in is returned unstarted
+def make_inputs(directory, geographies=3000, years=10, institutions=50,
+                seed=0, latency=0.0):
+    states = state_list()
+    per_state = max(1, math.ceil(geographies / len(states)))
+    fake = FakeCensus(counties_per_state=per_state, latency=latency,
+                      states=states)
+
+    # real counties whose code the fake census serves (odd, 001 to
+    # 2 * per_state - 1, as its geographies are numbered)
+    counties = gpd.read_file(county_shp, engine='pyogrio',
+                             columns=['GEOID', 'STATEFP', 'COUNTYFP',
+                                      'STATE_NAME'])
+    code = counties['COUNTYFP'].astype(int)
+    served = (counties['STATE_NAME'].isin(us_contiguous)
+              & (code % 2 == 1) & (code <= 2 * per_state - 1))
+    counties = counties[served].reset_index(drop=True)
+
+    ipedsids = [str(100000 + i) for i in range(institutions)]
+    uni_shp = os.path.join(directory, 'universities', 'universities.shp')
+    uni_states = write_universities(uni_shp, ipedsids, counties, seed)
+
+    year_list = list(range(2020 - years, 2020))
+    herd_csv = os.path.join(directory, 'herd.csv')
+    write_herd(herd_csv, ipedsids, list(uni_states), year_list, seed)
+
+    return {'census': fake, 'herd_file': herd_csv, 'uni_shp': uni_shp,
+            'ystart': year_list[0], 'yend': year_list[-1] + 1,
+            'rank_by': year_list[-1]}
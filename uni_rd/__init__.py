@@ -0,0 +1,2 @@
+# helpers for the university R&D fund project
+# the top level script 'Data Cleaning and Regression.py' imports from here
@@ -0,0 +1,6 @@
+import sys
+
+from uni_rd.cli import main
+
+# python -m uni_rd, the same as the uni-rd command
+sys.exit(main())
@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+import us
+
+from uni_rd import census, keys
+
+# census geography levels, in the order their codes make up a FIPS/GEOID
+GEO_LEVELS = ['state', 'county', 'tract', 'block group']
+
+
+# turn one raw census download (NAME, variables, state, county, ...) into
+# the project layout: year, state, county, county_id, state_id, COUNTYFIPS
+# and the variables renamed through column_map ({variable: column}).
+# Everything is done column-wise, there is no per-row python loop.
+def build_acs_frame(data, column_map, year):
+    levels = [level for level in GEO_LEVELS if level in data.columns]
+
+    state_id = data['state'].astype(str)
+    county_id = data['county'].astype(str)
+    fips = state_id + county_id
+
+    # NAME is 'Merced County, California' for counties and
+    # 'Census Tract 1, Merced County, California' below that. The county
+    # and state parts are the same for every row of a county, so only one
+    # NAME per county is split and the result is broadcast back.
+    codes, _ = pd.factorize(fips)
+    _, first = np.unique(codes, return_index=True)
+    parts = data['NAME'].iloc[first].astype(str).str.rpartition(',')
+    county = parts[0].str.rpartition(',')[2].str.strip().to_numpy()
+    state = parts[2].str.strip().to_numpy()
+
+    frame = pd.DataFrame({'year': np.full(len(data), year, dtype='int64'),
+                          'state': state[codes],
+                          'county': county[codes],
+                          'county_id': county_id.to_numpy(),
+                          'state_id': state_id.to_numpy(),
+                          'COUNTYFIPS': fips.to_numpy()},
+                         index=data.index)
+
+    # finer geographies keep their own codes and a full GEOID
+    if len(levels) > 2:
+        geoid = frame['COUNTYFIPS']
+        for level in levels[2:]:
+            frame[level] = data[level].astype(str)
+            geoid = geoid + frame[level]
+        frame['GEOID'] = geoid
+
+    for var, column in column_map.items():
+        frame[column] = data[var].to_numpy()
+
+    return frame.reset_index(drop=True)
+
+
+# several years of downloads ({year: raw frame}) into one panel,
+# concatenated once at the end
+def build_acs_panel(downloads, column_map, years=None):
+    years = sorted(downloads) if years is None else years
+    frames = [build_acs_frame(downloads[year], column_map, year)
+              for year in years]
+    if not frames:
+        return pd.DataFrame(columns=['year', 'state', 'county', 'county_id',
+                                     'state_id', 'COUNTYFIPS',
+                                     *column_map.values()])
+
+    return pd.concat(frames, ignore_index=True)
+
+
+# census variables for population (B05002) and income (B19301),
+# mapped to the column names we use
+population_columns = {'B05002_001E': 'total_population',
+                      'B05002_002E': 'total_native',
+                      'B05002_003E': 'total_born_in_state',
+                      'B05002_004E': 'total_born_out_state',
+                      'B05002_009E': 'total_born_outside_US',
+                      'B05002_013E': 'total_foreign_born'}
+income_columns = {'B19301_001E': 'income_past12m'}
+
+us_contiguous = [state.name for state in us.STATES_CONTIGUOUS]
+
+
+# function for retrieving every census table for a range of years at once,
+# all variables of a year go in one call and the years run in parallel
+# (responses are cached on disk, published ACS vintages never change)
+def get_acs5_county_data(ystart, yend):
+    years = list(range(ystart, yend))
+    data = census.download_years('acs5', years, [('county', '*')],
+                                 [*population_columns, *income_columns])
+
+    return data
+
+
+# function for retreiving muiltiple years of population data
+def get_population_df(ystart, yend, acs_data=None):
+    years = list(range(ystart, yend))
+    if acs_data is None:
+        acs_data = get_acs5_county_data(ystart, yend)
+
+    # build every year with FIPS, state and county columns,
+    # concatenated once
+    df_population = build_acs_panel(acs_data, population_columns, years)
+    df_population = df_population[df_population['state'].isin(us_contiguous)]
+
+    return df_population
+
+
+def get_income_df(ystart, yend, acs_data=None):
+    years = list(range(ystart, yend))
+    if acs_data is None:
+        acs_data = get_acs5_county_data(ystart, yend)
+
+    df_income = build_acs_panel(acs_data, income_columns, years)
+    df_income = df_income[df_income['state'].isin(us_contiguous)]
+
+    return df_income
+
+
+# merge income and pop data on county level for the contiguous states,
+# joined on the packed year/FIPS key
+def get_county_df(ystart, yend):
+    acs_data = get_acs5_county_data(ystart, yend)
+    pop_df = get_population_df(ystart, yend, acs_data)
+    income_df = get_income_df(ystart, yend, acs_data)
+    df = keys.join(pop_df, income_df, keys.frame_key(pop_df),
+                   keys.frame_key(income_df), equal=['state', 'county'],
+                   shared=['year', 'county_id', 'state_id', 'COUNTYFIPS'])
+
+    return df
@@ -0,0 +1,349 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from uni_rd import instrument
+from uni_rd.config import cache_dir
+
+# Census API endpoint, can be pointed at uni_rd.fake_census for offline work
+CENSUS_API_URL = os.environ.get('CENSUS_API_URL',
+                                'https://api.census.gov/data')
+CENSUS_API_KEY = os.environ.get('CENSUS_API_KEY')
+
+# same dataset names censusdata uses, mapped to the API path
+DATASETS = {'acs1': 'acs/acs1',
+            'acs5': 'acs/acs5',
+            'acs5_subject': 'acs/acs5/subject',
+            'acs1_subject': 'acs/acs1/subject'}
+
+# published ACS vintages never change, so the cache only has to bound
+# its size; max_age is there for the odd re-release
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+
+
+# the API takes at most 50 names per call, NAME is always one of them
+MAX_VARIABLES = 49
+
+# retry/backoff and rate limiting for the live API
+MAX_RETRIES = 5
+BACKOFF = 0.5
+REQUESTS_PER_SECOND = 10
+
+
+class CacheMiss(LookupError):
+    pass
+
+
+# turn [('state', '17'), ('county', '*')] into the API for/in parameters
+def geo_params(geo):
+    geo = [(level, str(code)) for level, code in geo]
+    params = {'for': '{}:{}'.format(*geo[-1])}
+    if len(geo) > 1:
+        params['in'] = ' '.join('{}:{}'.format(*g) for g in geo[:-1])
+
+    return params
+
+
+# the cache key is built from everything that changes the response,
+# variables are sorted so the same request in a different order still hits
+def cache_key(dataset, year, geo, variables):
+    geo = [[level, str(code)] for level, code in geo]
+    raw = json.dumps([dataset, int(year), geo, sorted(variables)])
+
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class CensusCache:
+    # API responses are stored one file per request as compressed numpy
+    # string arrays (header + rows), no pickle involved. One cache is
+    # shared by the download threads: the counters and eviction are done
+    # under a lock, and a file another thread (or process) evicted in the
+    # meantime is a miss, not an error
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES,
+                 max_age=None, offline=False):
+        self.directory = directory or os.path.join(cache_dir, 'census')
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        instrument.count('census_cache_hits' if hit
+                         else 'census_cache_misses')
+
+    def get(self, key):
+        fname = self._file(key)
+        try:
+            stat = os.stat(fname)
+            age = time.time() - stat.st_mtime
+            if self.max_age is not None and age > self.max_age:
+                os.remove(fname)
+                self._count(hit=False)
+                return None
+
+            with np.load(fname, allow_pickle=False) as stored:
+                header = stored['header'].tolist()
+                rows = stored['rows']
+
+            # touch the file so eviction drops the least recently used
+            # first
+            os.utime(fname)
+        except FileNotFoundError:
+            self._count(hit=False)
+            return None
+
+        self._count(hit=True)
+
+        return header, rows
+
+    def put(self, key, header, rows):
+        fname = self._file(key)
+        # unique per process and thread: the sweep/inference pools and
+        # other runs can share the directory
+        tmp = f'{fname}.{os.getpid()}.{threading.get_ident()}.tmp'
+        # the API sends null for suppressed cells, store those as ''
+        rows = [['' if value is None else value for value in row]
+                for row in rows]
+        rows = np.asarray(rows, dtype=str).reshape(-1, len(header))
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, header=np.asarray(header, dtype=str),
+                                rows=rows)
+        os.replace(tmp, fname)
+        self.evict()
+
+    def entries(self):
+        entries = []
+        for fname in os.listdir(self.directory):
+            if fname.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, fname))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, fname))
+
+        return sorted(entries)
+
+    def _remove(self, fname):
+        try:
+            os.remove(os.path.join(self.directory, fname))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        with self._lock:
+            entries = self.entries()
+            now = time.time()
+            total = sum(size for _, size, _ in entries)
+            for mtime, size, fname in entries:
+                expired = (self.max_age is not None
+                           and now - mtime > self.max_age)
+                if not expired and total <= self.max_bytes:
+                    continue
+                self._remove(fname)
+                total -= size
+
+    def clear(self):
+        with self._lock:
+            for _, _, fname in self.entries():
+                self._remove(fname)
+
+
+_default_cache = None
+
+
+def default_cache():
+    global _default_cache
+    if _default_cache is None:
+        offline = os.environ.get('CENSUS_OFFLINE', '') not in ('', '0')
+        _default_cache = CensusCache(offline=offline)
+
+    return _default_cache
+
+
+# token bucket shared by every thread using the same API key
+class RateLimiter:
+    def __init__(self, rate=REQUESTS_PER_SECOND, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens
+                                  + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def rate_limiter(key):
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter()
+
+        return _limiters[key]
+
+
+# one pooled session, so concurrent requests reuse their connections
+def make_session(pool_size=16):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+
+_session = None
+
+
+def default_session():
+    global _session
+    if _session is None:
+        _session = make_session()
+
+    return _session
+
+
+def _retryable(error):
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+
+    return False
+
+
+# one raw API request, returns the JSON table (header row first);
+# throttled per API key and retried with exponential backoff
+def fetch_table(dataset, year, geo, variables, base_url=None, key=None,
+                session=None, retries=MAX_RETRIES):
+    base_url = (base_url or CENSUS_API_URL).rstrip('/')
+    url = '{}/{}/{}'.format(base_url, year, DATASETS.get(dataset, dataset))
+    params = {'get': ','.join(['NAME', *variables]), **geo_params(geo)}
+    key = key or CENSUS_API_KEY
+    if key:
+        params['key'] = key
+    session = session or default_session()
+    limiter = rate_limiter(key)
+
+    for attempt in range(retries + 1):
+        limiter.wait()
+        try:
+            response = session.get(url, params=params, timeout=60)
+            instrument.count('census_requests')
+            instrument.count('network_bytes', len(response.content))
+            response.raise_for_status()
+            break
+        except requests.RequestException as error:
+            if attempt == retries or not _retryable(error):
+                raise
+            time.sleep(BACKOFF * 2 ** attempt)
+    try:
+        table = response.json()
+    except ValueError:
+        raise ValueError(f'Unexpected response (URL: {response.url}): '
+                         f'{response.text[:200]}')
+
+    return table[0], table[1:]
+
+
+# convert the string table to a frame: NAME, the variables as numbers and
+# one column per geography level (e.g. state, county)
+def table_to_frame(header, rows, variables):
+    rows = np.asarray(rows, dtype=object).reshape(-1, len(header))
+    data = pd.DataFrame(rows, columns=header)
+    for var in variables:
+        data[var] = pd.to_numeric(data[var], errors='coerce')
+    geo_columns = [col for col in header
+                   if col != 'NAME' and col not in variables]
+
+    return data[['NAME', *variables, *geo_columns]]
+
+
+# drop-in for censusdata.download that goes through the on-disk cache,
+# offline=True never touches the network and raises CacheMiss instead
+def download(dataset, year, geo, variables, cache=None, offline=None,
+             base_url=None, key=None, session=None):
+    cache = cache or default_cache()
+    offline = cache.offline if offline is None else offline
+    variables = list(variables)
+    ckey = cache_key(dataset, year, geo, variables)
+
+    stored = cache.get(ckey)
+    if stored is None:
+        if offline:
+            raise CacheMiss(f'{dataset} {year} {geo} is not cached '
+                            '(offline mode)')
+        header, rows = fetch_table(dataset, year, geo, variables,
+                                   base_url=base_url, key=key,
+                                   session=session)
+        cache.put(ckey, header, rows)
+    else:
+        header, rows = stored
+
+    return table_to_frame(header, rows, variables)
+
+
+# several years (and several tables) in parallel: the variables of all
+# tables go into one call per year, split only at the API limit, and the
+# calls run on a bounded thread pool sharing one pooled session
+def download_years(dataset, years, geo, variables, max_workers=8,
+                   cache=None, offline=None, base_url=None, key=None):
+    variables = list(dict.fromkeys(variables))
+    chunks = [variables[i:i + MAX_VARIABLES]
+              for i in range(0, len(variables), MAX_VARIABLES)]
+    cache = cache or default_cache()
+    session = default_session()
+
+    def fetch(job):
+        year, chunk = job
+        return download(dataset, year, geo, chunk, cache=cache,
+                        offline=offline, base_url=base_url, key=key,
+                        session=session)
+
+    jobs = [(year, chunk) for year in years for chunk in chunks]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        frames = list(pool.map(fetch, jobs))
+
+    data = {}
+    for (year, _), frame in zip(jobs, frames):
+        if year not in data:
+            data[year] = frame
+            continue
+        geo_columns = [col for col in frame.columns
+                       if col not in variables]
+        data[year] = data[year].merge(frame, on=geo_columns, how='outer')
+
+    return data
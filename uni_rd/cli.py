@@ -0,0 +1,230 @@
+import argparse
+import os
+import sys
+
+# The uni-rd command: the pipeline of stages.py run from a shell or cron,
+# one subcommand per part of it (fetch the inputs, build the panel, run
+# the regressions, draw the plots) and plan to see what is stale. Only
+# the standard library is imported up front; pandas, geopandas,
+# statsmodels, matplotlib and the rest are imported by the stages that
+# need them, when they run. A subcommand whose stages are all cached
+# reads their manifests and returns without loading anything.
+#
+#     uni-rd fetch --ystart 2010 --yend 2020 --offline
+#     uni-rd regress --absorb year COUNTYFIPS --reps 200 --out results
+#     uni-rd plan
+#     python -m uni_rd plot --batch --workers 4
+
+regress_stages = ['regression', 'inference', 'sweep']
+# render.kinds, spelled out so --help does not import matplotlib
+render_kinds = ('map', 'trend', 'county')
+
+
+# stage parameters given on the command line, over stages.default_params
+def get_params(args):
+    from uni_rd.stages import default_params
+
+    given = {'ystart': args.ystart, 'yend': args.yend, 'nuni': args.nuni,
+             'rank_by': args.rank_by,
+             'absorb': getattr(args, 'absorb', None),
+             'cluster': getattr(args, 'cluster', None),
+             'reps': getattr(args, 'reps', None),
+             'seed': getattr(args, 'seed', None)}
+    if given['rank_by'] is not None and len(given['rank_by']) == 1:
+        given['rank_by'] = given['rank_by'][0]
+    params = {**default_params,
+              **{k: v for k, v in given.items() if v is not None}}
+    if params['nuni'] == 'all':
+        params['nuni'] = None
+
+    return params
+
+
+# --nuni is a count or 'all'
+def nuni_arg(value):
+    if value == 'all':
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value!r} is not a number or "
+                                         "'all'")
+
+
+# run the target stages; returns their outputs, or None after a dry run
+# or when load is False and every stage was cached
+def run_stages(args, targets, load=True):
+    from uni_rd.stages import get_pipeline, print_plan
+
+    params = get_params(args)
+    pipeline = get_pipeline()
+    plan = print_plan(params, targets, args.force, pipeline)
+    stale = [name for name, status in plan if status == 'rebuild']
+    if args.dry_run or not (load or stale):
+        return None
+
+    results = pipeline.run(params, targets, args.force,
+                           profile=args.profile)
+    print(pipeline.report.summary())
+    print(f'run report: {pipeline.report_file}')
+
+    return results
+
+
+def fetch(args):
+    if args.offline:
+        os.environ['CENSUS_OFFLINE'] = '1'
+    run_stages(args, ['census', 'herd', 'herd_all', 'uni_counties'],
+               load=False)
+
+
+# the panel stage, and the census and HERD frames written to outdir as
+# csv and to the columnar store when they were rebuilt or are missing
+def build_panel(args):
+    from uni_rd.config import refined_data
+
+    outputs = {'census': 'df_income_pop', 'herd': 'uni_fund_df'}
+    outdir = args.outdir or refined_data
+    missing = [name for name in outputs.values()
+               if not os.path.exists(os.path.join(outdir, f'{name}.csv'))]
+
+    results = run_stages(args, ['panel', *outputs],
+                         load=bool(missing or args.force))
+    if results is None:
+        return
+
+    from uni_rd import store
+    os.makedirs(outdir, exist_ok=True)
+    for stage, name in outputs.items():
+        results[stage].to_csv(os.path.join(outdir, f'{name}.csv'),
+                              index=False, encoding='utf-8')
+        if not args.no_store:
+            store.write_dataset(results[stage], name)
+    print(f'panel: {len(results["panel"])} rows, csv in {outdir}')
+
+
+# the fund regression table, and with --out every result as csv
+def regress(args):
+    targets = [s for s in regress_stages if s not in args.skip]
+    results = run_stages(args, targets,
+                         load=not args.quiet or bool(args.out))
+    if results is None:
+        return
+
+    fit = results['regression']['fit']
+    if not args.quiet:
+        print(fit.table())
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+        tables = {**results, 'regression': fit.table()}
+        for name in targets:
+            tables[name].to_csv(os.path.join(args.out, f'{name}.csv'),
+                                index=False)
+
+
+# the trend plots stage; --batch also renders the per-state and
+# per-county charts (render.py), skipping those that are unchanged
+def plot(args):
+    run_stages(args, ['plots'], load=False)
+    if not args.batch or args.dry_run:
+        return
+
+    from uni_rd import render
+    from uni_rd.dashboard import DashboardData
+
+    result = render.render_all(DashboardData.from_pipeline(get_params(args)),
+                               args.outdir or render.batch_dir, args.year,
+                               args.kinds or render.kinds, args.workers,
+                               progress=True)
+    print(f"{len(result['written'])} written, "
+          f"{len(result['skipped'])} unchanged")
+
+
+def plan(args):
+    from uni_rd.stages import print_plan
+
+    print_plan(get_params(args), args.stages or None, args.force)
+
+
+def get_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--ystart', type=int, help='first year (2010)')
+    common.add_argument('--yend', type=int,
+                        help='year after the last one (2020)')
+    common.add_argument('--nuni', type=nuni_arg,
+                        help="keep the top n institutions, or 'all' (50)")
+    common.add_argument('--rank-by', type=int, nargs='+',
+                        help='year(s) whose fund ranks the institutions')
+    common.add_argument('--force', action='append', default=[],
+                        metavar='STAGE', help='rebuild a cached stage')
+    common.add_argument('--dry-run', action='store_true',
+                        help='only list the stages that would run')
+    common.add_argument('--profile', metavar='STAGE',
+                        help='run one stage under cProfile')
+
+    model = argparse.ArgumentParser(add_help=False)
+    model.add_argument('--absorb', nargs='+', help='fixed effects (year)')
+    model.add_argument('--cluster', help='cluster level (IPEDSID)')
+    model.add_argument('--reps', type=int,
+                       help='bootstrap/permutation replicates (1000)')
+    model.add_argument('--seed', type=int)
+
+    parser = argparse.ArgumentParser(
+        prog='uni-rd', description='university R&D fund and county '
+                                   'outcomes pipeline')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    sub = commands.add_parser('fetch', parents=[common],
+                              help='download ACS, parse HERD and locate '
+                                   'the institutions')
+    sub.add_argument('--offline', action='store_true',
+                     help='answer census requests from the cache only')
+    sub.set_defaults(func=fetch)
+
+    sub = commands.add_parser('build-panel', parents=[common],
+                              help='merge the county-year panel and write '
+                                   'the refined data')
+    sub.add_argument('--outdir', help='csv directory (refined_data)')
+    sub.add_argument('--no-store', action='store_true',
+                     help='skip the columnar store')
+    sub.set_defaults(func=build_panel)
+
+    sub = commands.add_parser('regress', parents=[common, model],
+                              help='fund regressions, inference and the '
+                                   'specification sweep')
+    sub.add_argument('--skip', nargs='+', default=[],
+                     choices=regress_stages[1:],
+                     help='leave out inference and/or the sweep')
+    sub.add_argument('--out', help='directory for the result tables')
+    sub.add_argument('--quiet', action='store_true',
+                     help='do not print the regression table')
+    sub.set_defaults(func=regress)
+
+    sub = commands.add_parser('plot', parents=[common],
+                              help='trend plots, and with --batch the '
+                                   'static charts')
+    sub.add_argument('--batch', action='store_true')
+    sub.add_argument('--outdir', help='batch chart directory')
+    sub.add_argument('--year', type=int, help='batch charts of one year')
+    sub.add_argument('--kinds', nargs='+', choices=render_kinds,
+                     help='batch chart kinds (all)')
+    sub.add_argument('--workers', type=int)
+    sub.set_defaults(func=plot)
+
+    sub = commands.add_parser('plan', parents=[common, model],
+                              help='list which stages are cached')
+    sub.add_argument('stages', nargs='*', help='targets (all stages)')
+    sub.set_defaults(func=plan)
+
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    args.func(args)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
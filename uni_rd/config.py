@@ -0,0 +1,36 @@
+import json
+import os
+
+# repository root, so nothing depends on one person's machine
+path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+raw_data = os.path.join(path, 'raw_data')
+refined_data = os.path.join(path, 'refined_data')
+
+# raw inputs read by the stages, named here so the pipeline can be
+# declared without importing the modules that read them
+herd_file = os.path.join(raw_data, 'NCSES', 'HERD_data_IPEDS.csv')
+uni_shp = os.path.join(raw_data, 'Colleges_and_Universities-shp',
+                       'Colleges_and_Universities.shp')
+county_shp = os.path.join(raw_data, 'cb_2020_us_county_20m',
+                          'cb_2020_us_county_20m.shp')
+
+# local caches that are not committed (see .gitignore)
+cache_dir = os.environ.get('UNI_RD_CACHE', os.path.join(path, '.cache'))
+
+
+# size and mtime of shape files (.shp, .dbf, .shx), the caches built from
+# them (university lookup, county topology) are rebuilt when they change
+def file_signature(*fnames):
+    signature = []
+    for fname in fnames:
+        base = os.path.splitext(fname)[0]
+        for ext in ('.shp', '.dbf', '.shx'):
+            try:
+                stat = os.stat(base + ext)
+            except FileNotFoundError:
+                continue
+            signature.append([os.path.basename(base + ext), stat.st_size,
+                              stat.st_mtime_ns])
+
+    return json.dumps(signature)
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+
+# A county-year panel prepared for dashboards. Rows are sorted by
+# (state, county, year) once, every county keeps the contiguous range of
+# its rows, and the population shares are computed up front, so looking up
+# one county's series is a dict lookup plus an array slice instead of a
+# boolean mask over the whole frame on every widget change.
+
+# count column -> share of total population
+share_columns = {'total_native': 'share_native',
+                 'total_born_in_state': 'share_born_in_state',
+                 'total_born_out_state': 'share_born_out_state',
+                 'total_born_outside_US': 'share_born_outside_US',
+                 'total_foreign_born': 'share_foreigner'}
+
+
+class PanelCube:
+    def __init__(self, columns, ranges, counties, state_ranges):
+        self.columns = columns
+        self.ranges = ranges
+        self.counties = counties
+        self.state_ranges = state_ranges
+
+    @classmethod
+    def from_frame(cls, df):
+        df = df.copy()
+        for count, share in share_columns.items():
+            if count in df.columns and share not in df.columns:
+                df[share] = df[count] / df['total_population']
+
+        order = np.lexsort((df['year'].to_numpy(),
+                            df['county'].to_numpy().astype(str),
+                            df['state'].to_numpy().astype(str)))
+        df = df.iloc[order].reset_index(drop=True)
+        columns = {name: df[name].to_numpy() for name in df.columns}
+
+        # start of every (state, county) run in the sorted rows
+        state = columns['state'].astype(str)
+        county = columns['county'].astype(str)
+        new = np.ones(len(df), dtype=bool)
+        new[1:] = (state[1:] != state[:-1]) | (county[1:] != county[:-1])
+        starts = np.flatnonzero(new)
+        stops = np.append(starts[1:], len(df))
+
+        ranges = {}
+        counties = {}
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            key = (str(state[start]), str(county[start]))
+            ranges[key] = (start, stop)
+            counties.setdefault(key[0], []).append(key[1])
+
+        # a state's counties are contiguous too
+        state_ranges = {}
+        for name in counties:
+            first = ranges[(name, counties[name][0])][0]
+            last = ranges[(name, counties[name][-1])][1]
+            state_ranges[name] = (first, last)
+
+        return cls(columns, ranges, counties, state_ranges)
+
+    def __len__(self):
+        return len(self.columns['year'])
+
+    @property
+    def states(self):
+        return list(self.counties)
+
+    def _range(self, state, county):
+        try:
+            return self.ranges[(state, county)]
+        except KeyError:
+            raise KeyError(f'{county}, {state} is not in the panel')
+
+    # arrays of one county, year order; views into the cube, no copy
+    def series(self, state, county, variables=('year',)):
+        start, stop = self._range(state, county)
+        return {name: self.columns[name][start:stop] for name in variables}
+
+    # arrays of every county-year of one state, (county, year) order
+    def state_series(self, state, variables=('year',)):
+        try:
+            start, stop = self.state_ranges[state]
+        except KeyError:
+            raise KeyError(f'{state} is not in the panel')
+        return {name: self.columns[name][start:stop] for name in variables}
+
+    def frame(self, state, county, variables=None):
+        variables = list(self.columns) if variables is None else variables
+        return pd.DataFrame(self.series(state, county, variables))
+
+    # what data_plot_pop gave the line plot: year and the share of one
+    # population group
+    def share_series(self, state, county, variable):
+        share = share_columns.get(variable, variable)
+        data = self.series(state, county, ['year', share])
+        return {'year': data['year'], variable: data[share]}
+
+    # year, income and fund of one county (data_plot_income)
+    def income_series(self, state, county):
+        return self.series(state, county, ['year', 'income_past12m', 'fund'])
+
+
+# cube stage: fund by county (as in the presentation notebook) with its
+# population and income, ready for the dashboards
+def get_panel_cube(uni_df, uni_counties, df):
+    from uni_rd.plots import get_fund_county
+
+    return PanelCube.from_frame(get_fund_county(uni_df, uni_counties, df))
@@ -0,0 +1,410 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from bokeh.application import Application
+from bokeh.application.handlers import FunctionHandler
+from bokeh.io import curdoc
+from bokeh.layouts import column, row
+from bokeh.models import (ColorBar, ColumnDataSource, HoverTool,
+                          LinearColorMapper, NumeralTickFormatter, Select,
+                          Slider)
+from bokeh.palettes import brewer
+from bokeh.plotting import figure
+
+from uni_rd import keys
+from uni_rd.cube import PanelCube
+
+# The presentation dashboards as a Bokeh server application: the county
+# choropleth of one state and year, and the line plots of one county.
+# Every session builds its figures and data sources once; a widget change
+# only sends the columns that changed (source.patch, source.stream for
+# added years) or, when the rows change (another state), new data for the
+# same source, never a new figure. The payloads behind the updates (one
+# county's series, one state's geometry, one state-year's values) come
+# from a server-side LRU cache shared by all sessions, so a viewer mostly
+# pays a dict lookup.
+#
+#     bokeh serve uni_rd/dashboard.py     or     python -m uni_rd.dashboard
+
+# field, low, high, tick format, label (format_data of the notebook)
+map_fields = [('total_population', 0, 12000000, '0,0', 'Total Population'),
+              ('total_native', 0, 6750000, '0,0', 'Total Native'),
+              ('total_born_in_state', 0, 5200000, '0,0',
+               'Total Born in State'),
+              ('total_born_out_state', 0, 2000000, '0,0',
+               'Total Born out State'),
+              ('total_born_outside_US', 0, 130000, '0,0',
+               'Total Born outside US'),
+              ('total_foreign_born', 0, 3500000, '0,0', 'Total Foreigner'),
+              ('income_past12m', 0, 80000, '$0,0',
+               'Income in Past 12 Months')]
+map_format = pd.DataFrame(map_fields, columns=['field', 'min_range',
+                                               'max_range', 'format',
+                                               'verbage'])
+
+# population shares of the line plot (format_data_line)
+line_fields = {'Born in State': 'total_born_in_state',
+               'Born out State': 'total_born_out_state',
+               'Born outside US': 'total_born_outside_US',
+               'Foreigner': 'total_foreign_born'}
+
+default_state = 'Michigan'
+default_county = 'Washtenaw County'
+
+
+class PayloadCache:
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # cached value of key, built (outside the lock) on a miss
+    def get(self, key, build):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        value = build()
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class DashboardData:
+    # fund_cube: the 'cube' stage (counties with a university),
+    # county_cube: the whole census panel, topology: the county
+    # geometry (the 'topology' stage), universities: IPEDSID, NAME,
+    # state, lon, lat plus the fund per year; level is the
+    # simplification the maps are drawn at
+    def __init__(self, fund_cube, county_cube, topology, universities,
+                 cache=None, level='high'):
+        self.fund_cube = fund_cube
+        self.county_cube = county_cube
+        self.topology = topology
+        self.level = level
+        self.universities = universities
+        self.cache = cache or PayloadCache()
+        years = county_cube.columns['year']
+        self.years = (int(years.min()), int(years.max()))
+
+    @classmethod
+    def from_pipeline(cls, params=None):
+        from uni_rd.stages import default_params, get_pipeline
+
+        params = {**default_params, **(params or {})}
+        results = get_pipeline().run(
+            params, targets=['cube', 'census', 'herd_all', 'uni_counties',
+                             'topology'])
+        lookup = results['uni_counties'].drop_duplicates('IPEDSID')
+        lookup = lookup[['IPEDSID', 'NAME', 'lon', 'lat']]
+        universities = keys.join(results['herd_all'], lookup,
+                                 keys.frame_key(results['herd_all'],
+                                                'IPEDSID', None),
+                                 keys.frame_key(lookup, 'IPEDSID', None),
+                                 shared=['IPEDSID'])
+
+        return cls(results['cube'], PanelCube.from_frame(results['census']),
+                   results['topology'], universities)
+
+    # year and the population share of one county (line plot)
+    def line(self, state, county, variable):
+        return self.cache.get(
+            ('line', state, county, variable),
+            lambda: self.fund_cube.share_series(state, county, variable))
+
+    # year, income and fund of one county
+    def income(self, state, county):
+        return self.cache.get(
+            ('income', state, county),
+            lambda: self.fund_cube.income_series(state, county))
+
+    # GEOID, county name and patches of every county of a state
+    def state_geometry(self, state):
+        def build():
+            data = self.county_cube.state_series(
+                state, ['COUNTYFIPS', 'county', 'year'])
+            names = (pd.Series(data['county'], index=data['COUNTYFIPS'])
+                     .groupby(level=0).first())
+            geoids = names.index[np.isin(names.index.to_numpy(),
+                                         self.topology.geoids)]
+            geoids, xs, ys = self.topology.patches(self.level, geoids)
+            return {'GEOID': geoids,
+                    'NAME': names.loc[geoids].to_numpy(),
+                    'state': np.full(len(geoids), state, dtype=object),
+                    'xs': xs, 'ys': ys}
+
+        return self.cache.get(('geometry', state), build)
+
+    # values of one variable for one state and year, in the order of
+    # state_geometry; NaN where a county has no data that year
+    def map_values(self, state, year, variable):
+        def build():
+            data = self.county_cube.state_series(
+                state, ['COUNTYFIPS', 'year', variable])
+            found = data['year'] == year
+            geoids = self.state_geometry(state)['GEOID']
+            position = pd.Index(geoids).get_indexer(
+                data['COUNTYFIPS'][found])
+            values = np.full(len(geoids), np.nan)
+            values[position[position >= 0]] = (
+                data[variable][found][position >= 0])
+            return values
+
+        return self.cache.get(('map', state, year, variable), build)
+
+    # campus points of one state with their fund in one year
+    def campuses(self, state, year):
+        def build():
+            unis = self.universities[self.universities['state'] == state]
+            points = unis.drop_duplicates('IPEDSID').sort_values('IPEDSID')
+            fund = (unis[unis['year'] == year].set_index('IPEDSID')['fund']
+                    .reindex(points['IPEDSID']))
+            return {'x': points['lon'].to_numpy(),
+                    'y': points['lat'].to_numpy(),
+                    'NAME': points['NAME'].to_numpy(),
+                    'fund': fund.to_numpy('float64')}
+
+        return self.cache.get(('campuses', state, year), build)
+
+
+# a session's own copy of a cached payload: patches write into the
+# source's arrays, which must never be the shared cache (or cube) arrays
+def session_data(data):
+    return {name: np.array(values) if isinstance(values, np.ndarray)
+            else list(values) for name, values in data.items()}
+
+
+# bring source to data with the smallest change: patch the columns whose
+# values changed, stream added rows, and only replace the data when rows
+# went away or the columns differ; returns what was sent
+def update_source(source, data, columns=None):
+    old = source.data
+    n_old = len(next(iter(old.values()), []))
+    n_new = len(next(iter(data.values())))
+    if set(old) != set(data) or n_new < n_old:
+        source.data = session_data(data)
+        return 'replace'
+
+    columns = list(data) if columns is None else columns
+    patches = {}
+    for name in columns:
+        current = np.asarray(old[name])
+        new = np.asarray(data[name][:n_old])
+        floats = current.dtype.kind == 'f' and new.dtype.kind == 'f'
+        if not np.array_equal(current, new, equal_nan=floats):
+            patches[name] = [(slice(0, n_old), new)]
+    if patches:
+        source.patch(patches)
+    if n_new > n_old:
+        source.stream({name: np.array(data[name][n_old:])
+                       for name in data})
+        return 'stream'
+
+    return 'patch' if patches else 'unchanged'
+
+
+def map_figure(source, field, mapper, campus_source):
+    spec = map_format.set_index('field').loc[field]
+    p = figure(title=spec['verbage'], height=650, width=850)
+    p.xgrid.grid_line_color = None
+    p.ygrid.grid_line_color = None
+    p.axis.visible = False
+
+    r1 = p.patches('xs', 'ys', source=source,
+                   fill_color={'field': 'value', 'transform': mapper},
+                   line_color='black', line_width=0.25, fill_alpha=1)
+    p.add_layout(ColorBar(color_mapper=mapper, label_standoff=18,
+                          border_line_color=None, location=(0, 0)), 'right')
+    p.add_tools(HoverTool(renderers=[r1],
+                          tooltips=[('County', '@NAME'), ('State', '@state'),
+                                    ('Value', '@value{,}')]))
+
+    r2 = p.scatter('x', 'y', color='red', source=campus_source, size=10,
+                   fill_alpha=0.7)
+    p.add_tools(HoverTool(renderers=[r2], tooltips=[('School', '@NAME'),
+                                                    ('Fund', '@fund{,}')]))
+
+    return p
+
+
+def line_figure(source, y, title, y_label, color, money=False):
+    fmt = '{$0,0}' if money else '{0.0000}'
+    p = figure(title=title, x_axis_label='Year', y_axis_label=y_label,
+               tooltips=[('value', f'@{y}{fmt}'), ('year', '@year')],
+               height=400)
+    p.line(x='year', y=y, source=source, color=color)
+    p.scatter(x='year', y=y, source=source, color='grey')
+    if money:
+        p.yaxis.formatter = NumeralTickFormatter(format='$0')
+
+    return p
+
+
+# build one session's document; all sessions share data (and its cache)
+def make_document(doc, data):
+    states = data.fund_cube.states
+    state = default_state if default_state in states else states[0]
+    counties = data.fund_cube.counties[state]
+    county = default_county if default_county in counties else counties[0]
+    year = data.years[1] - (data.years[1] - data.years[0]) // 2
+    field = 'income_past12m'
+    share = 'Born outside US'
+
+    select_state = Select(title='Select Target State:', value=state,
+                          options=states)
+    select_county = Select(title='Select County:', value=county,
+                           options=counties)
+    select_share = Select(title='Population Share:', value=share,
+                          options=list(line_fields))
+    select_field = Select(title='Select Criteria:',
+                          value=map_format.set_index('field')
+                          .loc[field, 'verbage'],
+                          options=map_format['verbage'].tolist())
+    slider = Slider(title='Year', start=data.years[0], end=data.years[1],
+                    step=1, value=year)
+
+    map_state = state if state in data.county_cube.states else None
+    geometry = data.state_geometry(map_state) if map_state else {
+        'GEOID': [], 'NAME': [], 'state': [], 'xs': [], 'ys': []}
+    map_source = ColumnDataSource(session_data({**geometry, 'value': (
+        data.map_values(map_state, year, field) if map_state else [])}))
+    campus_source = ColumnDataSource(session_data(data.campuses(state,
+                                                                year)))
+    spec = map_format.set_index('field').loc[field]
+    mapper = LinearColorMapper(palette=brewer['Blues'][8][::-1],
+                               low=spec['min_range'], high=spec['max_range'])
+    map_plot = map_figure(map_source, field, mapper, campus_source)
+
+    line_source = ColumnDataSource(session_data(
+        data.line(state, county, line_fields[share])))
+    income_source = ColumnDataSource(session_data(data.income(state,
+                                                              county)))
+    share_plot = line_figure(line_source, line_fields[share],
+                             f'Share of Total Population: {share}',
+                             'natural units', 'blue')
+    income_plot = line_figure(income_source, 'income_past12m',
+                              'Income in Past 12 Months', 'in USD', 'green',
+                              money=True)
+    fund_plot = line_figure(income_source, 'fund', 'R&D Fund', 'in USD',
+                            'magenta', money=True)
+
+    def field_name():
+        return map_format.loc[map_format['verbage'] == select_field.value,
+                              'field'].iloc[0]
+
+    # the map: new state -> new rows, otherwise only the values change
+    def update_map(attr, old, new):
+        st = select_state.value
+        if st not in data.county_cube.states:
+            return
+        name = field_name()
+        values = data.map_values(st, slider.value, name)
+        if attr == 'state':
+            map_source.data = session_data({**data.state_geometry(st),
+                                            'value': values})
+        else:
+            update_source(map_source, {**map_source.data, 'value': values},
+                          columns=['value'])
+        spec = map_format.set_index('field').loc[name]
+        mapper.update(low=spec['min_range'], high=spec['max_range'])
+        map_plot.title.text = spec['verbage']
+
+    def update_campuses():
+        update_source(campus_source,
+                      data.campuses(select_state.value, slider.value))
+
+    # the line plots keep their renderers, only y is renamed
+    def update_lines():
+        st, ct = select_state.value, select_county.value
+        if ct not in data.fund_cube.counties.get(st, []):
+            return
+        variable = line_fields[select_share.value]
+        series = data.line(st, ct, variable)
+        if variable not in line_source.data:
+            line_source.data = session_data(series)
+            for r in share_plot.renderers:
+                r.glyph.y = variable
+            share_plot.hover.tooltips = [('value', f'@{variable}{{0.0000}}'),
+                                         ('year', '@year')]
+            share_plot.title.text = ('Share of Total Population: '
+                                     f'{select_share.value}')
+        else:
+            update_source(line_source, series)
+        update_source(income_source, data.income(st, ct))
+
+    def on_state(attr, old, new):
+        counties = data.fund_cube.counties[new]
+        select_county.options = counties
+        if select_county.value in counties:
+            update_lines()
+        else:
+            # the county callback updates the lines
+            select_county.value = counties[0]
+        update_map('state', old, new)
+        update_campuses()
+
+    def on_year(attr, old, new):
+        update_map('year', old, new)
+        update_campuses()
+
+    select_state.on_change('value', on_state)
+    select_county.on_change('value', lambda attr, old, new: update_lines())
+    select_share.on_change('value', lambda attr, old, new: update_lines())
+    select_field.on_change('value', update_map)
+    slider.on_change('value', on_year)
+
+    doc.add_root(column(
+        row(select_state, select_county, select_share),
+        row(select_field, slider),
+        map_plot, share_plot, income_plot, fund_plot))
+    doc.title = 'University R&D Fund'
+
+    return doc
+
+
+_data = None
+
+
+# the data of this server process, loaded once for every session
+def get_data(params=None):
+    global _data
+    if _data is None:
+        _data = DashboardData.from_pipeline(params)
+    return _data
+
+
+def make_app(data=None):
+    data = data or get_data()
+    return Application(FunctionHandler(lambda doc: make_document(doc,
+                                                                 data)))
+
+
+def serve(port=5006, data=None, show=True):
+    from bokeh.server.server import Server
+
+    server = Server({'/': make_app(data)}, port=port, num_procs=1)
+    server.start()
+    if show:
+        server.io_loop.add_callback(server.show, '/')
+    server.io_loop.start()
+
+
+if __name__ == '__main__':
+    serve()
+elif __name__.startswith('bokeh_app_'):
+    # bokeh serve uni_rd/dashboard.py
+    make_document(curdoc(), get_data())
@@ -0,0 +1,229 @@
+import glob
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from uni_rd import acs, instrument
+from uni_rd.config import cache_dir, path
+
+# Bulk ingest of data.census.gov table exports (productDownload_*
+# directories): per vintage a <program><year>.<table>_data_with_overlays
+# CSV, its _metadata CSV (variable code -> label) and a _table_title text.
+# Variable codes move between vintages (B05002 grew from 15 to 27 lines
+# in 2015, S1901 swapped 'Households!!Estimate' for 'Estimate!!
+# Households' in 2017), so variables are asked for by label and looked up
+# in a catalog built from the metadata files, kept as JSON and only
+# re-read for files that changed. The data files are read in parallel,
+# only the wanted columns, and come out in the layout of the API fetchers
+# (acs.build_acs_frame), with no request sent. One call reads the tables
+# of one period: 5-year and 1-year estimates never share a row. A column
+# is only there when its table was exported for that period (the
+# History exports hold B05002 as 5-year and S1901 only as 1-year, and no
+# B19301, so the 5-year frame has the population columns only).
+#
+#     df = get_export_county_df(2010, 2020)
+
+export_dirs = sorted(glob.glob(os.path.join(path, 'History',
+                                            'productDownload_*')))
+catalog_file = os.path.join(cache_dir, 'export_catalog.json')
+
+# program prefix of the file names -> census.DATASETS name
+PROGRAMS = {'ACSDT5Y': 'acs5', 'ACSDT1Y': 'acs1',
+            'ACSST5Y': 'acs5_subject', 'ACSST1Y': 'acs1_subject'}
+# datasets of each period, a table exported from both is taken from the
+# first
+periods = {'acs5': ['acs5', 'acs5_subject'], 'acs1': ['acs1', 'acs1_subject']}
+
+file_pattern = re.compile(r'(?P<program>[A-Z0-9]+?)(?P<year>\d{4})\.'
+                          r'(?P<table>\w+?)_(?P<kind>data_with_overlays|'
+                          r'metadata)_')
+
+# output column -> (table, label), labels as normalized by label_key;
+# S1901 has no per capita income, its household income columns are
+# ingested under their own names
+concepts = {
+    'total_population': ('B05002', 'Total'),
+    'total_native': ('B05002', 'Native'),
+    'total_born_in_state': ('B05002', 'Native!!Born in state of residence'),
+    'total_born_out_state': ('B05002', 'Native!!Born in other state in the '
+                                       'United States'),
+    'total_born_outside_US': ('B05002', 'Native!!Born outside the United '
+                                        'States'),
+    'total_foreign_born': ('B05002', 'Foreign born'),
+    'income_past12m': ('B19301', 'Per capita income in the past 12 months '
+                                 '(in inflation-adjusted dollars)'),
+    'median_household_income': ('S1901', 'Households!!Median income '
+                                         '(dollars)'),
+    'mean_household_income': ('S1901', 'Households!!Mean income (dollars)'),
+}
+
+
+# 'Estimate!!Total:!!Native:' and 'Households!!Estimate!!Total' style
+# labels of every vintage to one form: estimates only, the 'Estimate' and
+# 'Total' parts and trailing colons dropped, dollar years taken out
+def label_key(label):
+    parts = [part.strip().rstrip(':') for part in label.split('!!')]
+    if any(p.startswith('Margin of Error') for p in parts):
+        return None
+    parts = [p for p in parts if p not in ('Estimate', 'Total')]
+    key = '!!'.join(parts) or 'Total'
+
+    return re.sub(r'in \d{4} inflation', 'in inflation', key)
+
+
+# every data/metadata file of the export directories as a frame of
+# dataset, year, table, data, metadata
+def scan_exports(directories=None):
+    directories = export_dirs if directories is None else directories
+    files = {}
+    for directory in directories:
+        for fname in sorted(glob.glob(os.path.join(directory, '*.csv'))):
+            match = file_pattern.match(os.path.basename(fname))
+            if not match or match['program'] not in PROGRAMS:
+                continue
+            key = (PROGRAMS[match['program']], int(match['year']),
+                   match['table'])
+            files.setdefault(key, {})[match['kind']] = fname
+
+    rows = [(*key, kinds.get('data_with_overlays'), kinds.get('metadata'))
+            for key, kinds in files.items()]
+
+    return pd.DataFrame(rows, columns=['dataset', 'year', 'table', 'data',
+                                       'metadata']).dropna()
+
+
+def _signature(fname):
+    stat = os.stat(fname)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+# {metadata file: {label key: variable code}}, cached in catalog_file
+# with the size and mtime of each metadata file
+def variable_catalog(metadata_files, fname=catalog_file):
+    try:
+        with open(fname) as f:
+            stored = json.load(f)
+    except (FileNotFoundError, ValueError):
+        stored = {}
+
+    catalog, changed = {}, False
+    for metadata in metadata_files:
+        entry = stored.get(metadata)
+        if entry is not None and entry['signature'] == _signature(metadata):
+            instrument.count('export_catalog_hits')
+            catalog[metadata] = entry['variables']
+            continue
+        instrument.count('export_catalog_misses')
+        labels = pd.read_csv(metadata, header=None, names=['code', 'label'],
+                             dtype=str)
+        variables = {}
+        for code, label in zip(labels['code'], labels['label']):
+            key = label_key(str(label))
+            if key is not None and code.endswith('E'):
+                variables.setdefault(key, code)
+        stored[metadata] = {'signature': _signature(metadata),
+                            'variables': variables}
+        catalog[metadata] = variables
+        changed = True
+
+    if changed:
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname + '.tmp', 'w') as f:
+            json.dump(stored, f)
+        os.replace(fname + '.tmp', fname)
+
+    return catalog
+
+
+# '1,234', '250,000+' and '2,500-' (top/bottom coded) to numbers; '*****',
+# '(X)', 'N', '-' and the like to NaN
+def to_numbers(values):
+    values = pd.Series(values, dtype=str).str.replace(',', '', regex=False)
+    values = values.str.replace(r'(?<=\d)[+-]$', '', regex=True)
+
+    return pd.to_numeric(values, errors='coerce').to_numpy()
+
+
+# the county rows of one data file as a raw API frame: NAME, the
+# variables, state, county
+def read_export(fname, codes):
+    data = pd.read_csv(fname, skiprows=[1], dtype=str,
+                       usecols=['GEO_ID', 'NAME', *codes])
+    # GEO_ID is <summary level>0000US<state><county>, 050 for counties
+    geo_id = data['GEO_ID'].str.partition('US')
+    data = data[geo_id[0].str.startswith('050')]
+    fips = geo_id[2][data.index]
+
+    raw = pd.DataFrame({'NAME': data['NAME'].to_numpy()})
+    for code in codes:
+        raw[code] = to_numbers(data[code])
+    raw['state'] = fips.str.slice(0, 2).to_numpy()
+    raw['county'] = fips.str.slice(2, 5).to_numpy()
+
+    return raw
+
+
+# {year: frame in the layout of the API fetchers} for the wanted output
+# columns of one period ('acs5' or 'acs1'), every (table, year) file read
+# on a thread pool
+def load_exports(columns=None, years=None, directories=None,
+                 max_workers=8, period='acs5'):
+    if period not in periods:
+        raise ValueError(f'unknown period {period!r}, one of {[*periods]}')
+    datasets = periods[period]
+    columns = list(concepts) if columns is None else columns
+    files = scan_exports(directories)
+    files = files[files['dataset'].isin(datasets)]
+    if years is not None:
+        files = files[files['year'].isin(list(years))]
+    files = files[files['table'].isin({concepts[c][0] for c in columns})]
+    files = files.assign(rank=files['dataset'].map(datasets.index))
+    files = files.sort_values('rank').drop_duplicates(['year', 'table'])
+    catalog = variable_catalog(files['metadata'].tolist())
+
+    def read(job):
+        year, table, data, metadata = job
+        variables = catalog[metadata]
+        column_map = {variables[label]: column
+                      for column, (t, label) in concepts.items()
+                      if t == table and column in columns
+                      and label in variables}
+        raw = read_export(data, list(column_map))
+        return year, acs.build_acs_frame(raw, column_map, year)
+
+    jobs = list(files[['year', 'table', 'data', 'metadata']]
+                .itertuples(index=False))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        frames = list(pool.map(read, jobs))
+
+    keys = ['year', 'state', 'county', 'county_id', 'state_id',
+            'COUNTYFIPS']
+    data = {}
+    for year, frame in frames:
+        instrument.count('export_rows', len(frame))
+        data[year] = (frame if year not in data else
+                      data[year].merge(frame, on=keys, how='outer'))
+
+    return data
+
+
+# county panel of the export directories for ystart to yend, the layout of
+# acs.get_county_df with whatever of its columns the exports of the period
+# hold
+def get_export_county_df(ystart, yend, columns=None, directories=None,
+                         period='acs5'):
+    data = load_exports(columns, range(ystart, yend), directories,
+                        period=period)
+    if not data:
+        return pd.DataFrame(columns=['year', 'state', 'county', 'county_id',
+                                     'state_id', 'COUNTYFIPS'])
+    df = pd.concat([data[year] for year in sorted(data)],
+                   ignore_index=True)
+    df = df[df['state'].isin(acs.us_contiguous)]
+    df['year'] = df['year'].astype(np.int64)
+
+    return df.sort_values(['year', 'COUNTYFIPS'], ignore_index=True)
@@ -0,0 +1,106 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.spatial import cKDTree
+
+from uni_rd.config import cache_dir, county_shp
+
+# Spatial R&D exposure: every county gets the fund of all institutions
+# around it, weighted by distance, instead of only the fund of the
+# universities inside its borders. Distances are taken between county
+# centroids and campus points in an equal-area projection (meters), and
+# only pairs within max_km are ever looked at, through a KD-tree, so the
+# weight matrix is sparse and building it is O(n log n).
+
+projection = 'EPSG:5070'
+weights_file = os.path.join(cache_dir, 'exposure_weights.npz')
+
+
+# GEOID and projected centroid of every county
+def county_centroids(fname=county_shp):
+    counties = gpd.read_file(fname, columns=['GEOID'], engine='pyogrio')
+    centroids = counties.to_crs(projection).geometry.centroid
+
+    return pd.DataFrame({'COUNTYFIPS': counties['GEOID'].to_numpy(),
+                         'x': centroids.x.to_numpy(),
+                         'y': centroids.y.to_numpy()})
+
+
+# campus points (lon/lat from the university lookup) in the same projection
+def institution_points(uni_lookup):
+    points = gpd.GeoSeries(gpd.points_from_xy(uni_lookup['lon'],
+                                              uni_lookup['lat']),
+                           crs='EPSG:4326').to_crs(projection)
+
+    return np.column_stack([points.x.to_numpy(), points.y.to_numpy()])
+
+
+# distance decay, d and bandwidth in km
+def kernel_weights(d, kernel='exponential', bandwidth=50):
+    if kernel == 'radius':
+        return np.ones_like(d)
+    if kernel == 'exponential':
+        return np.exp(-d / bandwidth)
+    if kernel == 'gaussian':
+        return np.exp(-0.5 * (d / bandwidth) ** 2)
+    if kernel == 'inverse':
+        return 1 / (1 + d / bandwidth)
+    raise ValueError(f'unknown kernel {kernel!r}')
+
+
+# sparse county x institution weights for all pairs closer than max_km
+def exposure_weights(centroids, points, max_km=100, kernel='exponential',
+                     bandwidth=50):
+    county_tree = cKDTree(centroids[['x', 'y']].to_numpy())
+    uni_tree = cKDTree(points)
+    # ndarray output keeps pairs at distance 0 (campus on the centroid)
+    pairs = county_tree.sparse_distance_matrix(uni_tree, max_km * 1000,
+                                               output_type='ndarray')
+    data = kernel_weights(pairs['v'] / 1000, kernel, bandwidth)
+
+    return sp.csr_matrix((data, (pairs['i'], pairs['j'])),
+                         shape=(len(centroids), len(points)))
+
+
+def save_weights(weights, counties, ipedsids, fname=weights_file):
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    sp.save_npz(fname, weights)
+    np.savez(os.path.splitext(fname)[0] + '_index.npz',
+             counties=np.asarray(counties, dtype=str),
+             ipedsids=np.asarray(ipedsids, dtype=str))
+
+
+def load_weights(fname=weights_file):
+    weights = sp.load_npz(fname)
+    with np.load(os.path.splitext(fname)[0] + '_index.npz') as index:
+        return weights, index['counties'], index['ipedsids']
+
+
+# exposure of every county and year: sum over institutions of
+# weight(distance) x fund, one sparse matrix product for all years
+def get_fund_exposure(uni_df, uni_lookup, max_km=100, kernel='exponential',
+                      bandwidth=50, fname=county_shp):
+    fund = uni_df.pivot_table(index='IPEDSID', columns='year', values='fund',
+                              aggfunc='sum', dropna=False)
+    located = uni_lookup.drop_duplicates('IPEDSID').set_index('IPEDSID')
+    located = located.loc[located.index.intersection(fund.index)]
+    located = located.dropna(subset=['lon', 'lat'])
+    fund = fund.loc[located.index].fillna(0)
+
+    centroids = county_centroids(fname)
+    weights = exposure_weights(centroids, institution_points(located),
+                               max_km, kernel, bandwidth)
+    save_weights(weights, centroids['COUNTYFIPS'], located.index)
+
+    exposure = weights @ fund.to_numpy()
+    years = fund.columns.to_numpy()
+    result = pd.DataFrame({
+        'year': np.tile(years, len(centroids)).astype(int),
+        'COUNTYFIPS': np.repeat(centroids['COUNTYFIPS'].to_numpy(),
+                                len(years)),
+        'fund_exposure': exposure.ravel()})
+
+    return result
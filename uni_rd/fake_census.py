@@ -0,0 +1,172 @@
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+# a local stand-in for api.census.gov, it answers the same
+# /data/<year>/acs/acs5?get=NAME,...&for=county:*&in=state:17 requests
+# with deterministic synthetic numbers, so the fetch path can be run with
+# no network. Tracts and block groups are served too, like the real API
+# only within one state (for=tract:*&in=state:17 county:*):
+#
+#     with FakeCensus() as api:
+#         census.download('acs5', 2015, [('county', '*')], variables,
+#                         base_url=api.url)
+
+
+# state FIPS codes and names, taken from the us package when available
+def state_list():
+    try:
+        import us
+        return [(s.fips, s.name) for s in us.STATES]
+    except ImportError:
+        return [('17', 'Illinois'), ('06', 'California'), ('36', 'New York')]
+
+
+# levels below the county, only ever served within one state
+SMALL_AREAS = ('tract', 'block group')
+
+
+# deterministic values per (year, variable), one draw for every geography
+# (of a state, with key, for tracts and block groups)
+def synthetic_values(year, var, n, key=''):
+    seed = zlib.crc32(f'{year}:{var}{key}'.encode())
+    rng = np.random.default_rng(seed)
+    if var.startswith(('B19', 'S19')):
+        return rng.integers(15000, 60000, n)
+
+    return rng.integers(0, 500000, n)
+
+
+class FakeCensus:
+    def __init__(self, counties_per_state=5, latency=0.0, states=None,
+                 tracts_per_county=4, block_groups_per_tract=3):
+        self.counties_per_state = counties_per_state
+        self.tracts_per_county = tracts_per_county
+        self.block_groups_per_tract = block_groups_per_tract
+        self.latency = latency
+        self.states = states or state_list()
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    # all geographies of a level as (name, codes) where codes is a dict
+    def geographies(self, level, within):
+        geos = []
+        for state_fips, state_name in self.states:
+            if within.get('state', '*') not in ('*', state_fips):
+                continue
+            if level == 'state':
+                geos.append((state_name, {'state': state_fips}))
+                continue
+            for i in range(self.counties_per_state):
+                county = '{:03d}'.format(2 * i + 1)
+                name = f'County {county}, {state_name}'
+                codes = {'state': state_fips, 'county': county}
+                if level == 'county':
+                    geos.append((name, codes))
+                    continue
+                if within.get('county', '*') not in ('*', county):
+                    continue
+                for t in range(self.tracts_per_county):
+                    tract = '{:04d}00'.format(t + 1)
+                    tract_name = f'Census Tract {t + 1}, {name}'
+                    tract_codes = {**codes, 'tract': tract}
+                    if level == 'tract':
+                        geos.append((tract_name, tract_codes))
+                        continue
+                    for b in range(self.block_groups_per_tract):
+                        geos.append((f'Block Group {b + 1}, {tract_name}',
+                                     {**tract_codes,
+                                      'block group': str(b + 1)}))
+
+        return geos
+
+    def table(self, year, params):
+        variables = params['get'][0].split(',')
+        level, code = params['for'][0].split(':')
+        within = dict(g.split(':') for g in
+                      params.get('in', [''])[0].split() if g)
+        levels = ['state', 'county', *SMALL_AREAS]
+        if level not in levels:
+            raise KeyError(level)
+
+        if level in SMALL_AREAS:
+            # no nationwide requests, as with the real API
+            if within.get('state', '*') == '*':
+                raise KeyError(f'{level} needs a state')
+            geos = self.geographies(level, {'state': within['state']})
+            key = ':' + within['state']
+        else:
+            geos = self.geographies(level, {})
+            key = ''
+        values = {var: synthetic_values(year, var, len(geos), key)
+                  for var in variables if var != 'NAME'}
+
+        codes = levels[:levels.index(level) + 1]
+        table = [variables + codes]
+        for i, (name, geo) in enumerate(geos):
+            if code != '*' and geo[level] != code:
+                continue
+            if any(geo.get(k) != v for k, v in within.items() if v != '*'):
+                continue
+            row = [name if var == 'NAME' else str(values[var][i])
+                   for var in variables]
+            table.append(row + [geo[c] for c in codes])
+
+        return table
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with fake._lock:
+                    fake.requests += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                url = urlparse(self.path)
+                parts = url.path.strip('/').split('/')
+                try:
+                    year = int(parts[1])
+                    body = json.dumps(fake.table(year, parse_qs(url.query)))
+                    status = 200
+                except (IndexError, KeyError, ValueError) as error:
+                    body = f'error: unknown/unsupported request {error}'
+                    status = 400
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(body.encode('utf-8'))
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+        return self
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/data'
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
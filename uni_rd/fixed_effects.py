@@ -0,0 +1,187 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy import stats
+
+# Linear regression of several outcomes on the same regressors with
+# absorbed fixed effects. The design is factorized once: every fixed
+# effect becomes an integer code, the outcomes and regressors are
+# demeaned within those groups (alternating projections when there is
+# more than one), and all outcomes are solved by one least squares call
+# with a multi-column right hand side. Each outcome is estimated on its
+# own complete cases, as a separate OLS would; outcomes missing on the
+# same rows share one sample and one solve. No dummy columns are ever
+# built, so county x year panels over decades stay small in memory.
+
+
+class FixedEffects:
+    def __init__(self, df, absorb):
+        self.names = list(absorb)
+        self.codes = []
+        self.indicators = []
+        self.counts = []
+        n = len(df)
+        for name in self.names:
+            codes, uniques = pd.factorize(df[name], sort=True)
+            if (codes < 0).any():
+                raise ValueError(f'missing values in fixed effect {name}')
+            ones = np.ones(n)
+            self.codes.append(codes)
+            self.indicators.append(sp.csr_matrix(
+                (ones, (np.arange(n), codes)), shape=(n, len(uniques))))
+            self.counts.append(np.bincount(codes, minlength=len(uniques)))
+
+    # number of parameters the fixed effects absorb (intercept included)
+    @property
+    def dof(self):
+        if not self.names:
+            return 1
+        return sum(len(c) for c in self.counts) - (len(self.names) - 1)
+
+    def _group_means(self, i, data, weights=None):
+        if weights is None:
+            sums = self.indicators[i].T @ data
+            return sums / self.counts[i][:, None]
+        sums = self.indicators[i].T @ (data * weights[:, None])
+        totals = self.indicators[i].T @ weights
+        totals[totals == 0] = 1
+        return sums / totals[:, None]
+
+    # subtract the group means of every fixed effect from every column;
+    # with weights the means are weighted (a weight of 0 drops a row, as
+    # in the cluster bootstrap)
+    def demean(self, data, tol=1e-10, maxiter=1000, weights=None):
+        data = np.array(data, dtype='float64')
+        if not self.names:
+            return data - np.average(data, axis=0, weights=weights)
+        if len(self.names) == 1:
+            return data - self._group_means(0, data, weights)[self.codes[0]]
+
+        scale = np.abs(data).max(axis=0)
+        scale[scale == 0] = 1
+        for _ in range(maxiter):
+            change = 0
+            for i in range(len(self.names)):
+                means = self._group_means(i, data, weights)
+                data -= means[self.codes[i]]
+                change = max(change, (np.abs(means).max(axis=0)
+                                      / scale).max())
+            if change < tol:
+                break
+
+        return data
+
+
+# nobs, df_resid and n_clusters are per outcome (Series)
+class FEResult:
+    def __init__(self, outcomes, regressors, coef, se, nobs, dof_resid,
+                 n_clusters, absorb, cluster):
+        self.outcomes = outcomes
+        self.regressors = regressors
+        self.params = pd.DataFrame(coef, index=regressors, columns=outcomes)
+        self.bse = pd.DataFrame(se, index=regressors, columns=outcomes)
+        self.nobs = pd.Series(nobs, index=outcomes)
+        self.df_resid = pd.Series(dof_resid, index=outcomes)
+        self.n_clusters = pd.Series(n_clusters, index=outcomes)
+        self.absorb = absorb
+        self.cluster = cluster
+
+    @property
+    def tvalues(self):
+        return self.params / self.bse
+
+    @property
+    def pvalues(self):
+        df = self.n_clusters - 1 if self.cluster else self.df_resid
+        return 2 * stats.t.sf(np.abs(self.tvalues.to_numpy()),
+                              df.to_numpy())
+
+    # tidy table: one row per (outcome, term)
+    def table(self):
+        pvalues = pd.DataFrame(self.pvalues, index=self.regressors,
+                               columns=self.outcomes)
+        parts = {'coef': self.params, 'std_err': self.bse,
+                 't': self.tvalues, 'p_value': pvalues}
+        table = pd.concat({k: v.stack() for k, v in parts.items()}, axis=1)
+        table.index.names = ['term', 'outcome']
+        table = table.swaplevel().sort_index().reset_index()
+        table['nobs'] = self.nobs.reindex(table['outcome']).to_numpy()
+
+        return table
+
+
+# cluster-robust covariance of one outcome (CR1, as in Stata/statsmodels);
+# the small-sample correction needs two clusters and nobs > k
+def cluster_cov(x, resid, xtx_inv, clusters, n_clusters, nobs, k):
+    if n_clusters < 2:
+        raise ValueError(f'cluster-robust errors need at least 2 clusters, '
+                         f'got {n_clusters}')
+    if nobs <= k:
+        raise ValueError(f'{nobs} observations for {k} parameters')
+    scores = sp.csr_matrix((np.ones(nobs), (clusters, np.arange(nobs))),
+                           shape=(n_clusters, nobs)) @ (x * resid[:, None])
+    meat = scores.T @ scores
+    correction = (n_clusters / (n_clusters - 1)) * ((nobs - 1) / (nobs - k))
+
+    return correction * xtx_inv @ meat @ xtx_inv
+
+
+# least squares on outcomes and regressors already demeaned: coefficients
+# and standard errors (regressors x outcomes), cluster-robust when
+# clusters (integer codes) are given; fe_dof is FixedEffects.dof
+def solve_demeaned(y, x, fe_dof, clusters=None):
+    coef, *_ = np.linalg.lstsq(x, y, rcond=None)
+    resid = y - x @ coef
+    nobs = len(y)
+    k = x.shape[1] + fe_dof
+    dof_resid = nobs - k
+    xtx_inv = np.linalg.pinv(x.T @ x)
+
+    se = np.empty_like(coef)
+    n_clusters = 0
+    if clusters is not None:
+        n_clusters = int(clusters.max()) + 1
+        for j in range(y.shape[1]):
+            cov = cluster_cov(x, resid[:, j], xtx_inv, clusters, n_clusters,
+                              nobs, k)
+            se[:, j] = np.sqrt(np.diag(cov))
+    else:
+        sigma2 = (resid ** 2).sum(axis=0) / dof_resid
+        se[:] = np.sqrt(np.outer(np.diag(xtx_inv), sigma2))
+
+    return coef, se, nobs, dof_resid, n_clusters
+
+
+# fit every outcome on the regressors, absorbing the fixed effects in
+# absorb (e.g. ['year'], ['year', 'COUNTYFIPS'] or ['year', 'IPEDSID']);
+# cluster gives cluster-robust standard errors, otherwise they are the
+# usual homoskedastic ones. Every outcome uses the rows where it, the
+# regressors, fixed effects and cluster are all known.
+def fe_regression(df, outcomes, regressors, absorb=('year',), cluster=None):
+    outcomes = list(outcomes)
+    regressors = list(regressors)
+    absorb = list(absorb)
+    shared = regressors + absorb + ([cluster] if cluster else [])
+    data = df[list(dict.fromkeys(outcomes + shared))]
+    complete = data[shared].notna().all(axis=1).to_numpy()
+    known = data[outcomes].notna().to_numpy()
+    patterns, group = np.unique(known, axis=1, return_inverse=True)
+
+    coef = np.full((len(regressors), len(outcomes)), np.nan)
+    se = np.full_like(coef, np.nan)
+    nobs = np.zeros(len(outcomes), dtype='int64')
+    dof_resid = np.zeros(len(outcomes), dtype='int64')
+    n_clusters = np.zeros(len(outcomes), dtype='int64')
+    for g in range(patterns.shape[1]):
+        columns = np.flatnonzero(group.ravel() == g)
+        sample = data[complete & patterns[:, g]]
+        fe = FixedEffects(sample, absorb)
+        y = [outcomes[j] for j in columns]
+        demeaned = fe.demean(sample[y + regressors].to_numpy('float64'))
+        clusters = pd.factorize(sample[cluster])[0] if cluster else None
+        (coef[:, columns], se[:, columns], nobs[columns], dof_resid[columns],
+         n_clusters[columns]) = solve_demeaned(
+            demeaned[:, :len(y)], demeaned[:, len(y):], fe.dof, clusters)
+
+    return FEResult(outcomes, regressors, coef, se, nobs, dof_resid,
+                    n_clusters, absorb, cluster)
@@ -0,0 +1,114 @@
+import csv
+
+import numpy as np
+import pandas as pd
+
+from uni_rd.config import herd_file
+
+# the NCSES download starts with a metadata block (filters, deflator,
+# unit of measure), then the header row '<Fiscal Year>,2019,2018,...',
+# a '<measures>' row and a '[State],[IPEDS UnitID]' row before the data.
+# Rows without an institution ID are state totals or unmatched spending.
+header_marker = '<Fiscal Year>'
+
+
+# '1,000,184' -> 1000184.0, '-' (no data) -> nan
+def to_number(cell):
+    cell = cell.strip()
+    if cell in ('', '-'):
+        return np.nan
+
+    return float(cell.replace(',', ''))
+
+
+# Read the HERD file in one pass: one row per institution (state, IPEDSID)
+# and one float column per fiscal year; the metadata lines end up in
+# data.attrs (e.g. 'Unit of Measure': 'Thousands of Dollars')
+def read_herd(fname=herd_file):
+    metadata = {}
+    states = []
+    ids = []
+    values = []
+    with open(fname, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        for row in reader:
+            if len(row) > 1 and row[1] == header_marker:
+                years = [int(cell) for cell in row[2:] if cell.strip()]
+                break
+            if row and row[0]:
+                key, _, value = row[0].partition(':')
+                metadata[key.strip()] = (value or row[1]).strip()
+        else:
+            raise ValueError(f'no {header_marker} header row in {fname}')
+
+        ncol = len(years)
+        for row in reader:
+            # the data ends at the first empty line before the NOTES
+            if not row or not any(row):
+                if ids:
+                    break
+                continue
+            state, uni_id = row[0], row[1].strip()
+            if not uni_id.isdigit():
+                continue
+            states.append(state)
+            ids.append(uni_id)
+            values.append([to_number(cell) for cell in row[2:2 + ncol]])
+
+    data = pd.DataFrame(np.array(values, dtype='float64').reshape(-1, ncol),
+                        columns=years)
+    data.insert(0, 'IPEDSID', ids)
+    data.insert(0, 'state', states)
+    data.attrs.update(metadata)
+
+    return data
+
+
+# positions of the k largest values of a score, largest first;
+# argpartition keeps this linear in the number of institutions
+def top_k(score, k=None):
+    score = np.where(np.isnan(score), -np.inf, score)
+    if k is None or k >= len(score):
+        return np.argsort(-score, kind='stable')
+    top = np.argpartition(-score, k - 1)[:k]
+
+    return top[np.argsort(-score[top], kind='stable')]
+
+
+# rank institutions by one year (rank_by=2010), or by an aggregate over
+# several years (rank_by=[2015, ..., 2019], how='sum' or 'mean')
+def rank_institutions(data, rank_by=2010, k=None, how='sum'):
+    if np.ndim(rank_by) == 0:
+        score = data[rank_by].to_numpy()
+    else:
+        block = data[list(rank_by)].to_numpy()
+        score = getattr(np, f'nan{how}')(block, axis=1)
+
+    return data.iloc[top_k(score, k)].reset_index(drop=True)
+
+
+# Read Universities R&D Data based on ID, the nuni largest institutions
+# by rank_by (every institution when nuni is None), long format
+def get_uni_fund(ystart, yend, nuni=None, rank_by=2010, fname=herd_file):
+    data = read_herd(fname)
+    years = list(range(ystart, yend))
+
+    data = rank_institutions(data, rank_by, nuni)
+    fund = data[years].to_numpy()
+
+    # same layout as DataFrame.melt: all institutions for the first year,
+    # then the next year
+    rd_id_df = pd.DataFrame({'year': np.repeat(years, len(data)),
+                             'state': np.tile(data['state'].to_numpy(),
+                                              len(years)),
+                             'IPEDSID': np.tile(data['IPEDSID'].to_numpy(),
+                                                len(years)),
+                             'fund': fund.T.ravel()})
+
+    return rd_id_df
+
+
+# every institution of the file, ranked by rank_by: the HERD input of the
+# stages that cover all of HERD, whatever nuni the regression panel keeps
+def get_all_fund(ystart, yend, rank_by=2010, fname=herd_file):
+    return get_uni_fund(ystart, yend, None, rank_by, fname)
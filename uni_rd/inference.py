@@ -0,0 +1,190 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from uni_rd.fixed_effects import FixedEffects
+from uni_rd.regression import outcomes
+
+# Resampling inference for the fund coefficient: a cluster bootstrap
+# (clusters drawn with replacement, e.g. IPEDSID) and a permutation test
+# (fund shuffled within year). The regression data is turned into plain
+# numpy arrays once; every replicate only draws new weights or a new
+# permutation and re-solves the fixed-effects regression on those arrays,
+# no DataFrame is rebuilt. Replicates run in chunks on a process pool,
+# each chunk with its own seed spawned from one SeedSequence, so the
+# results only depend on the seed and not on the number of workers.
+#
+# Every outcome is estimated on its own complete rows, as fe_regression
+# does: the rows where the regressors, fixed effects, cluster and
+# permutation group are known are kept, and outcomes missing on the same
+# of those rows form one group with its own FixedEffects.
+
+
+class Design:
+    # groups: (rows, outcome columns, FixedEffects of those rows) per
+    # missingness pattern of the outcomes
+    def __init__(self, y, x, groups, clusters, perm_groups, outcomes,
+                 regressors):
+        self.y = y
+        self.x = x
+        self.groups = groups
+        self.clusters = clusters
+        self.n_clusters = clusters.max() + 1
+        self.perm_groups = perm_groups
+        self.outcomes = outcomes
+        self.regressors = regressors
+
+    @classmethod
+    def from_frame(cls, df, outcomes, regressors, absorb=('year',),
+                   cluster='IPEDSID', permute_within='year'):
+        outcomes = list(outcomes)
+        regressors = list(regressors)
+        absorb = list(absorb)
+        shared = list(dict.fromkeys([*regressors, *absorb, cluster,
+                                     permute_within]))
+        data = df[list(dict.fromkeys(outcomes + shared))]
+        data = data[data[shared].notna().all(axis=1)]
+        known = data[outcomes].notna().to_numpy()
+        patterns, group = np.unique(known, axis=1, return_inverse=True)
+
+        groups = []
+        for g in range(patterns.shape[1]):
+            rows = np.flatnonzero(patterns[:, g])
+            columns = np.flatnonzero(group.ravel() == g)
+            groups.append((rows, columns,
+                           FixedEffects(data.iloc[rows], absorb)))
+        clusters = pd.factorize(data[cluster], sort=True)[0]
+        perm_groups = pd.factorize(data[permute_within], sort=True)[0]
+
+        return cls(data[outcomes].to_numpy('float64'),
+                   data[regressors].to_numpy('float64'), groups, clusters,
+                   perm_groups, outcomes, regressors)
+
+
+# coefficients (regressors x outcomes) for one set of weights, each group
+# of outcomes on its rows
+def weighted_fit(design, x, weights):
+    coef = np.full((x.shape[1], design.y.shape[1]), np.nan)
+    for rows, columns, fe in design.groups:
+        y = design.y[np.ix_(rows, columns)]
+        demeaned = fe.demean(np.hstack([y, x[rows]]), weights=weights[rows])
+        yd = demeaned[:, :len(columns)]
+        xd = demeaned[:, len(columns):]
+        xw = xd * weights[rows, None]
+        coef[:, columns] = np.linalg.solve(xw.T @ xd, xw.T @ yd)
+
+    return coef
+
+
+_design = None
+
+
+def _init_worker(design):
+    global _design
+    _design = design
+
+
+def _bootstrap_chunk(seed, reps):
+    d = _design
+    rng = np.random.default_rng(seed)
+    out = np.empty((reps, d.x.shape[1], d.y.shape[1]))
+    for r in range(reps):
+        draws = rng.integers(0, d.n_clusters, d.n_clusters)
+        weights = np.bincount(draws, minlength=d.n_clusters)[d.clusters]
+        out[r] = weighted_fit(d, d.x, weights.astype(float))
+
+    return out
+
+
+def _permutation_chunk(seed, reps, column):
+    d = _design
+    rng = np.random.default_rng(seed)
+    out = np.empty((reps, d.x.shape[1], d.y.shape[1]))
+    weights = np.ones(len(d.y))
+    base = np.argsort(d.perm_groups, kind='stable')
+    x = d.x.copy()
+    for r in range(reps):
+        # random order inside each group, groups stay where they are
+        order = np.lexsort((rng.random(len(base)), d.perm_groups[base]))
+        x[base, column] = d.x[base[order], column]
+        out[r] = weighted_fit(d, x, weights)
+
+    return out
+
+
+# split reps into chunks, run them on a process pool and stack the draws
+# in chunk order; progress prints the share of finished replicates
+def _run(design, worker, reps, seed, workers, chunk_size, progress, *args):
+    workers = workers or os.cpu_count() or 1
+    sizes = [chunk_size] * (reps // chunk_size)
+    if reps % chunk_size:
+        sizes.append(reps % chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    results = [None] * len(sizes)
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(design,)) as pool:
+        futures = {pool.submit(worker, s, n, *args): i
+                   for i, (s, n) in enumerate(zip(seeds, sizes))}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            done += len(results[futures[future]])
+            if progress:
+                print(f'\r{done}/{reps} replicates', end='',
+                      file=sys.stderr)
+    if progress:
+        print(file=sys.stderr)
+
+    return np.concatenate(results) if results else np.empty((0,))
+
+
+def cluster_bootstrap(design, reps=1000, seed=0, workers=None,
+                      chunk_size=250, progress=False):
+    return _run(design, _bootstrap_chunk, reps, seed, workers, chunk_size,
+                progress)
+
+
+def permutation_test(design, reps=1000, term='fund', seed=0, workers=None,
+                     chunk_size=250, progress=False):
+    column = design.regressors.index(term)
+    return _run(design, _permutation_chunk, reps, seed, workers, chunk_size,
+                progress, column)
+
+
+# bootstrap standard error and percentile interval, permutation p-value
+# (two sided, share of permuted |coef| at least as large) per outcome
+def inference_table(df, outcomes, term='fund', absorb=('year',),
+                    cluster='IPEDSID', permute_within='year', reps=1000,
+                    seed=0, workers=None, progress=False, alpha=0.05):
+    design = Design.from_frame(df, outcomes, [term], absorb, cluster,
+                               permute_within)
+    observed = weighted_fit(design, design.x, np.ones(len(design.y)))[0]
+    boot = cluster_bootstrap(design, reps, seed, workers,
+                             progress=progress)[:, 0, :]
+    perm = permutation_test(design, reps, term, seed + 1, workers,
+                            progress=progress)[:, 0, :]
+
+    exceed = (np.abs(perm) >= np.abs(observed)).sum(axis=0)
+    table = pd.DataFrame({
+        'outcome': design.outcomes,
+        'term': term,
+        'coef': observed,
+        'boot_se': boot.std(axis=0, ddof=1),
+        'ci_low': np.quantile(boot, alpha / 2, axis=0),
+        'ci_high': np.quantile(boot, 1 - alpha / 2, axis=0),
+        'perm_p_value': (exceed + 1) / (reps + 1),
+        'reps': reps})
+
+    return table
+
+
+# inference stage: all regression outcomes, progress on stderr
+def get_inference_results(reg_data, absorb=('year',), cluster='IPEDSID',
+                          reps=1000, seed=0):
+    return inference_table(reg_data, list(outcomes.values()), 'fund',
+                           absorb=absorb, cluster=cluster, reps=reps,
+                           seed=seed, progress=True)
@@ -0,0 +1,209 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+
+from uni_rd.config import cache_dir
+
+# Measurements of one pipeline run. Every stage runs inside a
+# Measurement: wall and CPU time (child processes included once they are
+# joined), peak resident memory sampled from a thread (None without
+# psutil), rows in and out, and whatever the code underneath counts
+# through count() (census cache hits and misses, requests, bytes off the
+# network, ...). The pipeline collects them in a RunReport written as
+# JSON per run; one stage can be run under cProfile (Pipeline.run(...,
+# profile='regression') or UNI_RD_PROFILE=regression), its stats go next
+# to the report.
+
+report_dir = os.path.join(cache_dir, 'reports')
+
+try:
+    import psutil
+except ImportError:  # memory is then not measured, reported as None
+    psutil = None
+
+_lock = threading.Lock()
+_active = []
+
+
+# add n to a counter of every running measurement (thread safe, so the
+# census download threads count into their stage)
+def count(name, n=1):
+    with _lock:
+        for measurement in _active:
+            counters = measurement.counters
+            counters[name] = counters.get(name, 0) + n
+
+
+# rows of a frame/array, summed over the values of a dict or list
+# (frames are told by their shape, so pandas is not imported here)
+def rows_of(value):
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        rows = [rows_of(v) for v in value]
+        rows = [r for r in rows if r is not None]
+        return sum(rows) if rows else None
+    if hasattr(value, 'shape') and len(getattr(value, 'shape', ())):
+        return value.shape[0]
+    if hasattr(value, '__len__') and not isinstance(value, str):
+        return len(value)
+
+    return None
+
+
+# resident memory now, None without psutil: the standard library only
+# has the high-water mark of the whole process (ru_maxrss), which never
+# goes down, so a stage would be charged with the peak of any before it
+def _rss():
+    if psutil is None:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+# peak resident memory while a block runs, sampled from a thread; start
+# and peak are None (and no thread runs) without psutil
+class PeakRSS:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, _rss())
+
+    def __enter__(self):
+        self.start = _rss()
+        self.peak = self.start
+        self._thread = None
+        if self.start is not None:
+            self._done = threading.Event()
+            self._thread = threading.Thread(target=self._sample,
+                                            daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is None:
+            return
+        self._done.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss())
+
+
+def _mb(nbytes):
+    return None if nbytes is None else round(nbytes / 2 ** 20, 1)
+
+
+def _cpu():
+    times = os.times()
+    return (times.user + times.system + times.children_user
+            + times.children_system)
+
+
+class Measurement:
+    def __init__(self, name, inputs=None, status='run', profile=False):
+        self.name = name
+        self.status = status
+        self.input_rows = rows_of(inputs)
+        self.output_rows = None
+        self.counters = {}
+        self.profiler = cProfile.Profile() if profile else None
+        self.error = None
+
+    def __enter__(self):
+        with _lock:
+            _active.append(self)
+        self._rss = PeakRSS().__enter__()
+        self._cpu = _cpu()
+        self._wall = time.perf_counter()
+        if self.profiler:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.profiler:
+            self.profiler.disable()
+        self.wall = time.perf_counter() - self._wall
+        self.cpu = _cpu() - self._cpu
+        self._rss.__exit__()
+        with _lock:
+            _active.remove(self)
+        if exc is not None:
+            self.error = f'{exc_type.__name__}: {exc}'
+
+    def output(self, value):
+        self.output_rows = rows_of(value)
+        return value
+
+    # the most expensive functions by cumulative time
+    def profile_stats(self, limit=25):
+        out = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=out)
+        stats.sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
+
+    def to_dict(self):
+        return {'stage': self.name, 'status': self.status,
+                'wall_s': round(self.wall, 4), 'cpu_s': round(self.cpu, 4),
+                'rss_start_mb': _mb(self._rss.start),
+                'peak_rss_mb': _mb(self._rss.peak),
+                'input_rows': self.input_rows,
+                'output_rows': self.output_rows,
+                'counters': dict(self.counters), 'error': self.error}
+
+
+class RunReport:
+    def __init__(self, params=None):
+        self.started = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.run_id = time.strftime('%Y%m%dT%H%M%S') + f'-{os.getpid()}'
+        self.params = params or {}
+        self.stages = []
+        self.profiles = {}
+
+    def add(self, measurement):
+        self.stages.append(measurement.to_dict())
+        if measurement.profiler:
+            self.profiles[measurement.name] = measurement
+
+    def to_dict(self):
+        return {'run_id': self.run_id, 'started': self.started,
+                'params': self.params, 'stages': self.stages,
+                'total_wall_s': round(sum(s['wall_s'] for s in self.stages),
+                                      4)}
+
+    # report as <run_id>.json, profiled stages also as <run_id>-<stage>.prof
+    # (for snakeviz/pstats) and their top functions in the report
+    def write(self, directory=None):
+        directory = directory or report_dir
+        os.makedirs(directory, exist_ok=True)
+        report = self.to_dict()
+        for name, measurement in self.profiles.items():
+            fname = os.path.join(directory, f'{self.run_id}-{name}.prof')
+            measurement.profiler.dump_stats(fname)
+            for stage in report['stages']:
+                if stage['stage'] == name:
+                    stage['profile'] = {'file': fname,
+                                        'top': measurement.profile_stats()}
+        fname = os.path.join(directory, f'{self.run_id}.json')
+        with open(fname, 'w') as f:
+            json.dump(report, f, indent=1, default=str)
+
+        return fname
+
+    # one line per stage; peak MB is left blank when it was not measured
+    def summary(self):
+        lines = [f"{'stage':<14}{'status':<8}{'wall s':>9}{'cpu s':>9}"
+                 f"{'peak MB':>9}{'rows in':>10}{'rows out':>10}"]
+        for s in self.stages:
+            peak = s['peak_rss_mb']
+            peak = '' if peak is None else f'{peak:.0f}'
+            lines.append(f"{s['stage']:<14}{s['status']:<8}"
+                         f"{s['wall_s']:>9.2f}{s['cpu_s']:>9.2f}"
+                         f"{peak:>9}"
+                         f"{s['input_rows'] or '':>10}"
+                         f"{s['output_rows'] or '':>10}")
+
+        return '\n'.join(lines)
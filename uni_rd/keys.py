@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+
+# One int64 key per panel row instead of joins on several string columns:
+# year, state and county of the FIPS code packed as
+# year * 10^6 + state * 10^4 + county (the county part has a spare digit,
+# the synthetic benchmark counties go past 999 per state), and
+# year * 10^6 + IPEDSID for institutions. Codes are parsed once from
+# whatever they arrive as ('01001', 1001, 1001.0, '1001.0'), so a float
+# or string copy of the same code gives the same key and no row is
+# silently dropped. Joins are
+# many-to-one: the right side is sorted once (not at all when it already
+# is), the left side looks its keys up with searchsorted, and only the
+# matched positions are used to take the columns.
+
+FIPS_BASE = 10 ** 6
+IPEDSID_BASE = 10 ** 6
+MISSING = -1
+
+
+# parse strings once per distinct value (a panel repeats every code for
+# each year), numbers as they are
+def _per_value(parse, values):
+    values = pd.Series(values, copy=False)
+    if values.dtype.kind in 'iuf':
+        return parse(values)
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return parse(pd.Series(uniques, dtype=object))[codes]
+
+
+def _codes(values):
+    if values.dtype.kind not in 'iuf':
+        values = values.astype(str).str.strip()
+        values = values.str.replace(r'\.0+$', '', regex=True)
+    codes = pd.to_numeric(values, errors='coerce')
+
+    return np.where(np.isnan(codes), MISSING, codes).astype('int64')
+
+
+# integer codes of a FIPS/IPEDSID column, MISSING where there is none
+def code_values(values):
+    return _per_value(_codes, values)
+
+
+def _pack(year, codes, base):
+    if (codes >= base).any():
+        raise ValueError(f'code {codes.max()} does not fit a key ({base})')
+    year = np.asarray(year, dtype='int64')
+    return np.where(codes == MISSING, MISSING, year * base + codes)
+
+
+# state * 10^4 + county of FIPS codes; strings are split after the two
+# state digits, numbers (which lost their leading zero) are 5 digits
+def _fips(values):
+    if values.dtype.kind in 'iuf':
+        codes = _codes(values)
+        state, county = codes // 1000, codes % 1000
+    else:
+        values = values.astype(str).str.strip()
+        values = values.str.replace(r'\.0+$', '', regex=True).str.zfill(5)
+        state = _codes(values.str.slice(0, 2))
+        county = _codes(values.str.slice(2))
+    missing = (state == MISSING) | (county == MISSING)
+
+    return np.where(missing, MISSING, state * 10 ** 4 + county)
+
+
+def fips_values(values):
+    return _per_value(_fips, values)
+
+
+def panel_key(year, fips):
+    return _pack(year, fips_values(fips), FIPS_BASE)
+
+
+def uni_key(year, ipedsid):
+    return _pack(year, code_values(ipedsid), IPEDSID_BASE)
+
+
+# the keys of a frame: its panel_key column if it has one, otherwise
+# built from year and COUNTYFIPS (or only the codes of column, for
+# lookups without a year)
+def frame_key(frame, column='COUNTYFIPS', year='year'):
+    if column == 'COUNTYFIPS' and 'panel_key' in frame:
+        return frame['panel_key'].to_numpy()
+    if year is None:
+        return code_values(frame[column])
+    return panel_key(frame[year].to_numpy(), frame[column])
+
+
+class KeyIndex:
+    # sorted keys of the right side of a join and the row of each;
+    # duplicate keys are an error, the join is many-to-one
+    def __init__(self, keys):
+        keys = np.asarray(keys, dtype='int64')
+        if len(keys) > 1 and (keys[1:] > keys[:-1]).all():
+            self.order = None
+            self.sorted = keys
+        else:
+            self.order = np.argsort(keys, kind='stable')
+            self.sorted = keys[self.order]
+        duplicate = self.sorted[1:] == self.sorted[:-1]
+        duplicate &= self.sorted[1:] != MISSING
+        if duplicate.any():
+            raise ValueError(f'{int(duplicate.sum())} duplicate join keys, '
+                             f'e.g. {self.sorted[1:][duplicate][0]}')
+
+    # row of the right side for every key, -1 where it has none
+    def lookup(self, keys):
+        keys = np.asarray(keys, dtype='int64')
+        if not len(self.sorted):
+            return np.full(len(keys), -1, dtype='int64')
+        position = np.searchsorted(self.sorted, keys)
+        position = np.minimum(position, len(self.sorted) - 1)
+        found = (self.sorted[position] == keys) & (keys != MISSING)
+        rows = position if self.order is None else self.order[position]
+
+        return np.where(found, rows, -1)
+
+
+# left joined with right on one int64 key each: inner keeps the left rows
+# with a match (in their order), left keeps every left row with NaN for
+# the right columns. Columns on both sides must be named in shared (the
+# key columns, kept from the left) or in equal (which must also agree for
+# a row to match); any other overlap is an error, not silently dropped
+def join(left, right, left_key, right_key, how='inner', equal=(),
+         shared=(), index=None):
+    overlap = [c for c in right.columns if c in left.columns
+               and c not in shared and c not in equal]
+    if overlap:
+        raise ValueError(f'columns {overlap} are on both sides of the join')
+    index = KeyIndex(right_key) if index is None else index
+    rows = index.lookup(left_key)
+    matched = rows >= 0
+    for column in equal:
+        at = np.flatnonzero(matched)
+        same = (left[column].to_numpy()[at]
+                == right[column].to_numpy()[rows[at]])
+        matched[at[~same]] = False
+        rows[at[~same]] = -1
+    if how == 'inner':
+        left = left.iloc[np.flatnonzero(matched)]
+        rows = rows[matched]
+    elif how != 'left':
+        raise ValueError(f'unsupported join {how!r}')
+
+    result = left.reset_index(drop=True)
+    columns = [c for c in right.columns if c not in result.columns]
+    taken = right[columns].iloc[np.maximum(rows, 0)].reset_index(drop=True)
+    if how == 'left' and not matched.all():
+        taken = taken.where(np.broadcast_to(matched[:, None], taken.shape))
+
+    return pd.concat([result, taken], axis=1)
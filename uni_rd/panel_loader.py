@@ -0,0 +1,256 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from uni_rd import acs, census, exports, store
+from uni_rd.config import raw_data
+
+# One query API over every county source we have: the NHGIS 1990/2000
+# census extracts and the 2010+ ACS 5-year panel. A query only names the
+# columns, years and states it wants; nothing is read until collect(),
+# and then each source reads only the raw columns those outputs need
+# (usecols), skips files of years outside the query and reads in chunks.
+#
+#     panel = scan_panel().select(['total_population']).years(1990, 2020)
+#     df = panel.collect()
+
+nhgis_dir = os.path.join(raw_data, 'IPUMS NHGIS')
+
+# columns every source returns, before the requested values
+key_columns = ['year', 'state', 'county', 'county_id', 'state_id',
+               'COUNTYFIPS']
+value_columns = [*acs.population_columns.values(),
+                 *acs.income_columns.values()]
+
+
+# 'G0100010' -> '01001': G + state (2) + 0 + county (3) + 0
+def gisjoin_to_fips(gisjoin):
+    gisjoin = pd.Series(gisjoin, dtype=str)
+    return (gisjoin.str.slice(1, 3) + gisjoin.str.slice(4, 7)).to_numpy()
+
+
+class NHGISSource:
+    # files: {file name: {output column: [NHGIS columns summed into it]}},
+    # name_column is the 'Autauga County' style county name of that extract
+    def __init__(self, year, files, name_column, directory=nhgis_dir,
+                 chunksize=100000):
+        self.year = year
+        self.files = files
+        self.name_column = name_column
+        self.directory = directory
+        self.chunksize = chunksize
+
+    @property
+    def years(self):
+        return [self.year]
+
+    @property
+    def columns(self):
+        return [c for mapping in self.files.values() for c in mapping]
+
+    def _read_file(self, fname, mapping, states):
+        raw_columns = sorted({c for cols in mapping.values() for c in cols})
+        usecols = ['GISJOIN', 'STATE', 'STATEA', 'COUNTYA',
+                   self.name_column, *raw_columns]
+        # the second line of an NHGIS extract holds the column descriptions
+        reader = pd.read_csv(os.path.join(self.directory, fname),
+                             usecols=usecols, skiprows=[1],
+                             dtype={c: str for c in usecols[:5]},
+                             encoding='latin-1', chunksize=self.chunksize)
+        frames = []
+        for chunk in reader:
+            # the contiguous states only, as the ACS county panel
+            chunk = chunk[chunk['STATE'].isin(acs.us_contiguous)]
+            if states is not None:
+                chunk = chunk[chunk['STATE'].isin(states)]
+            frame = pd.DataFrame({
+                'year': np.full(len(chunk), self.year, dtype='int64'),
+                'state': chunk['STATE'].to_numpy(),
+                'county': chunk[self.name_column].to_numpy(),
+                'county_id': chunk['COUNTYA'].to_numpy(),
+                'state_id': chunk['STATEA'].to_numpy(),
+                'COUNTYFIPS': gisjoin_to_fips(chunk['GISJOIN'])})
+            for column, parts in mapping.items():
+                values = chunk[parts].apply(pd.to_numeric, errors='coerce')
+                frame[column] = values.sum(axis=1, min_count=1).to_numpy()
+            frames.append(frame)
+
+        return pd.concat(frames, ignore_index=True)
+
+    def read(self, columns, years=None, states=None):
+        if years is not None and self.year not in years:
+            return None
+
+        merged = None
+        for fname, mapping in self.files.items():
+            wanted = {c: mapping[c] for c in columns if c in mapping}
+            if not wanted:
+                continue
+            frame = self._read_file(fname, wanted, states)
+            merged = (frame if merged is None else
+                      merged.merge(frame, on=key_columns, how='outer'))
+
+        return merged
+
+
+class ACSSource:
+    # the ACS 5-year panel: from the columnar store when a year is there,
+    # otherwise downloaded (through the census cache) for just the
+    # variables the query needs
+    def __init__(self, years=range(2010, 2020), dataset='df_income_pop'):
+        self._years = list(years)
+        self.dataset = dataset
+        self.column_map = {**acs.population_columns, **acs.income_columns}
+
+    @property
+    def years(self):
+        return self._years
+
+    @property
+    def columns(self):
+        return list(self.column_map.values())
+
+    def read(self, columns, years=None, states=None):
+        years = [y for y in self._years if years is None or y in years]
+        columns = [c for c in columns if c in self.columns]
+        if not years or not columns:
+            return None
+
+        stored = set(store.stored_years(self.dataset))
+        frames = []
+        if stored & set(years):
+            frame = store.read_dataset(self.dataset, key_columns + columns,
+                                       sorted(stored & set(years)))
+            frames.append(frame.astype({'year': 'int64', 'state': str}))
+
+        missing = [y for y in years if y not in stored]
+        if missing:
+            column_map = {var: col for var, col in self.column_map.items()
+                          if col in columns}
+            downloads = census.download_years('acs5', missing,
+                                              [('county', '*')],
+                                              list(column_map))
+            frames.append(acs.build_acs_panel(downloads, column_map,
+                                              missing))
+
+        data = pd.concat(frames, ignore_index=True)
+        if states is not None:
+            data = data[data['state'].isin(states)]
+
+        return data[key_columns + columns]
+
+
+class ExportSource:
+    # data.census.gov table exports (uni_rd.exports) of one period
+    # ('acs5' or 'acs1'), read without a single API call, e.g.
+    # scan_panel([ExportSource()]) for a backfill
+    def __init__(self, years=range(2010, 2020), directories=None,
+                 period='acs5'):
+        self._years = list(years)
+        self.directories = directories
+        self.period = period
+
+    @property
+    def years(self):
+        return self._years
+
+    @property
+    def columns(self):
+        return list(exports.concepts)
+
+    def read(self, columns, years=None, states=None):
+        years = [y for y in self._years if years is None or y in years]
+        columns = [c for c in columns if c in self.columns]
+        if not years or not columns:
+            return None
+
+        data = exports.get_export_county_df(min(years), max(years) + 1,
+                                            columns, self.directories,
+                                            self.period)
+        data = data[data['year'].isin(years)]
+        if states is not None:
+            data = data[data['state'].isin(states)]
+
+        return data.reindex(columns=key_columns + columns)
+
+
+nativity_1990 = {'total_population': [f'E3N00{i}' for i in range(1, 10)],
+                 'total_native': [f'E3N00{i}' for i in range(1, 9)],
+                 'total_born_in_state': ['E3N001'],
+                 'total_born_out_state': ['E3N002', 'E3N003', 'E3N004',
+                                          'E3N005'],
+                 'total_born_outside_US': ['E3N006', 'E3N007', 'E3N008'],
+                 'total_foreign_born': ['E3N009']}
+nativity_2000 = {'total_population': ['GI8001', 'GI8002'],
+                 'total_native': ['GI8001'],
+                 'total_born_in_state': ['GI9001'],
+                 'total_born_out_state': ['GI9002'],
+                 'total_born_outside_US': ['GI9003'],
+                 'total_foreign_born': ['GI8002']}
+
+
+def default_sources():
+    return [
+        NHGISSource(1990, {'nativity_1990_county.csv': nativity_1990,
+                           'income_1990_county.csv':
+                           {'income_past12m': ['E01001']}},
+                    name_column='ANPSADPI'),
+        NHGISSource(2000, {'nativity_2000_county.csv': nativity_2000,
+                           'income_2000_county.csv':
+                           {'income_past12m': ['GNW001']}},
+                    name_column='NAME'),
+        ACSSource(),
+    ]
+
+
+# a lazy query; select/years/states return a new query, collect reads
+class PanelQuery:
+    def __init__(self, sources, columns=None, year_range=None, states=None):
+        self.sources = sources
+        self.columns = list(columns or value_columns)
+        self.year_range = year_range
+        self.states = states
+
+    def select(self, columns):
+        return PanelQuery(self.sources, columns, self.year_range, self.states)
+
+    # years(1990, 2020) is 1990-2019, years([1990, 2015]) only those two
+    def years(self, start, end=None):
+        years = list(start) if end is None else list(range(start, end))
+        return PanelQuery(self.sources, self.columns, years, self.states)
+
+    def where_states(self, states):
+        return PanelQuery(self.sources, self.columns, self.year_range,
+                          list(states))
+
+    def collect(self):
+        frames = []
+        for source in self.sources:
+            frame = source.read(self.columns, self.year_range, self.states)
+            if frame is not None and len(frame):
+                frames.append(frame)
+        if not frames:
+            return pd.DataFrame(columns=key_columns + self.columns)
+
+        panel = pd.concat(frames, ignore_index=True)
+        panel = panel.reindex(columns=key_columns + self.columns)
+
+        return panel.sort_values(['year', 'COUNTYFIPS'], ignore_index=True)
+
+
+def scan_panel(sources=None):
+    return PanelQuery(sources or default_sources())
+
+
+# eager shortcut, e.g. load_panel(['income_past12m'], range(1990, 2020))
+def load_panel(columns=None, years=None, states=None, sources=None):
+    query = scan_panel(sources)
+    if columns is not None:
+        query = query.select(columns)
+    if years is not None:
+        query = query.years(years)
+    if states is not None:
+        query = query.where_states(states)
+
+    return query.collect()
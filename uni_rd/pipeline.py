@@ -0,0 +1,306 @@
+import hashlib
+import importlib
+import importlib.util
+import inspect
+import json
+import os
+import pickle
+import re
+import tokenize
+
+from uni_rd import instrument
+from uni_rd.config import cache_dir, raw_data
+
+# The pipeline is a list of declared stages. Each stage fingerprints what
+# goes into it: its parameters, the raw files it reads, the source of its
+# module and of the package modules that imports, and the fingerprints of
+# the stages it depends on. A stage only runs again when that fingerprint
+# changes, otherwise its stored output is reused. run(..., dry_run=True)
+# only reports what would be rebuilt. Every run is measured stage by
+# stage (see instrument.py), the report is kept in pipeline.report and
+# written as JSON. A stage function can be given as 'module:function', it
+# is then only imported when the stage runs, so declaring, planning or
+# loading cached stages stays cheap.
+
+stage_dir = os.path.join(cache_dir, 'stages')
+
+
+# deps maps the argument name of func to the stage providing it,
+# a plain list means the argument has the stage's name; func is a
+# function or its 'module:function'
+class Stage:
+    def __init__(self, name, func, deps=(), params=(), files=()):
+        self.name = name
+        self.code = func
+        if not isinstance(deps, dict):
+            deps = {dep: dep for dep in deps}
+        self.deps = dict(deps)
+        self.params = list(params)
+        self.files = list(files)
+
+    @property
+    def func(self):
+        if isinstance(self.code, str):
+            module, name = self.code.split(':')
+            self.code = getattr(importlib.import_module(module), name)
+        return self.code
+
+    def __repr__(self):
+        return f'Stage({self.name!r})'
+
+
+# content hash of a file or of every file under a directory; hashes are
+# remembered by (size, mtime) so unchanged raw files are not read again
+class FileHasher:
+    def __init__(self, memo_file=None):
+        self.memo_file = memo_file or os.path.join(stage_dir, 'files.json')
+        try:
+            with open(self.memo_file) as f:
+                self.memo = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.memo = {}
+        self.changed = False
+
+    def file_digest(self, fname):
+        stat = os.stat(fname)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        known = self.memo.get(fname)
+        if known and known[:2] == stamp:
+            return known[2]
+
+        digest = hashlib.sha1()
+        with open(fname, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        self.memo[fname] = [*stamp, digest.hexdigest()]
+        self.changed = True
+
+        return digest.hexdigest()
+
+    def digest(self, fname):
+        if not os.path.exists(fname):
+            return 'missing'
+        if os.path.isfile(fname):
+            return self.file_digest(fname)
+
+        digest = hashlib.sha1()
+        for root, dirs, files in os.walk(fname):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                rel = os.path.relpath(full, fname)
+                digest.update(f'{rel}:{self.file_digest(full)};'.encode())
+
+        return digest.hexdigest()
+
+    def save(self):
+        if self.changed:
+            os.makedirs(os.path.dirname(self.memo_file), exist_ok=True)
+            with open(self.memo_file, 'w') as f:
+                json.dump(self.memo, f)
+            self.changed = False
+
+
+package = __name__.split('.')[0]
+_imports = {}
+
+
+def _module_source(name):
+    spec = importlib.util.find_spec(name)
+    if spec is None or not spec.origin or not spec.origin.endswith('.py'):
+        return None
+    with tokenize.open(spec.origin) as f:
+        return f.read()
+
+
+# 'from uni_rd.x import a, b', 'from uni_rd import (x, y)' and
+# 'import uni_rd.x', at any indentation (lazy imports in functions too)
+import_pattern = re.compile(
+    rf'^[ \t]*(?:from[ \t]+({package}(?:\.\w+)?)[\w.]*[ \t]+import'
+    rf'[ \t]+(\([^)]*\)|[^\n#]*)|import[ \t]+({package}\.\w+))', re.M)
+
+
+# modules of this package that a source imports (the package is flat, so
+# 'from uni_rd.config import cache_dir' is the module config); scanned
+# once per source text
+def _local_imports(source):
+    if source in _imports:
+        return _imports[source]
+    names = set()
+    for module, imported, plain in import_pattern.findall(source):
+        if plain:
+            names.add(plain)
+        elif module != package:
+            names.add(module)
+        else:
+            names.update(f'{package}.{name.split()[0]}'
+                         for name in imported.strip('()').split(',')
+                         if name.strip())
+    _imports[source] = frozenset(names)
+
+    return _imports[source]
+
+
+# hash of the source of the module defining func and of every module of
+# the package it imports, directly or through other modules, so an edit
+# to a helper (fixed_effects, keys, census, ...) invalidates the stages
+# using it; a 'module:function' name is hashed from the module files
+# without importing anything
+def source_digest(func):
+    todo = set()
+    if isinstance(func, str):
+        source = _module_source(func.split(':')[0])
+        todo = set(_local_imports(source))
+    else:
+        try:
+            source = inspect.getsource(inspect.getmodule(func) or func)
+            todo = set(_local_imports(source))
+        except (OSError, TypeError):
+            source = func.__qualname__
+    sources = [source]
+    seen = set()
+    while todo:
+        name = todo.pop()
+        seen.add(name)
+        module_source = _module_source(name)
+        if module_source is None:
+            continue
+        sources.append(f'{name}\n{module_source}')
+        todo |= _local_imports(module_source) - seen
+
+    digest = hashlib.sha1()
+    for part in [sources[0], *sorted(sources[1:])]:
+        digest.update(part.encode('utf-8'))
+
+    return digest.hexdigest()
+
+
+class Pipeline:
+    def __init__(self, stages, directory=None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.directory = directory or stage_dir
+
+    def _output_file(self, name):
+        return os.path.join(self.directory, f'{name}.pkl')
+
+    def _manifest_file(self, name):
+        return os.path.join(self.directory, f'{name}.json')
+
+    def stored_fingerprint(self, name):
+        try:
+            with open(self._manifest_file(name)) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if not os.path.exists(self._output_file(name)):
+            return None
+
+        return manifest.get('fingerprint')
+
+    # the stages needed for the targets, dependencies first
+    def order(self, targets=None):
+        targets = list(self.stages) if targets is None else targets
+        ordered = []
+
+        def visit(name):
+            if name in ordered:
+                return
+            for dep in self.stages[name].deps.values():
+                visit(dep)
+            ordered.append(name)
+
+        for name in targets:
+            visit(name)
+
+        return ordered
+
+    def fingerprints(self, params, targets=None, hasher=None):
+        hasher = hasher or FileHasher()
+        fingerprints = {}
+        for name in self.order(targets):
+            stage = self.stages[name]
+            parts = {'stage': name,
+                     'code': source_digest(stage.code),
+                     'params': {p: params.get(p) for p in stage.params},
+                     'files': {os.path.relpath(f, raw_data):
+                               hasher.digest(f) for f in stage.files},
+                     'deps': {arg: fingerprints[dep]
+                              for arg, dep in stage.deps.items()}}
+            raw = json.dumps(parts, sort_keys=True, default=str)
+            digest = hashlib.sha1(raw.encode('utf-8'))
+            fingerprints[name] = digest.hexdigest()
+        hasher.save()
+
+        return fingerprints
+
+    # which stages would run: [(name, 'rebuild' or 'cached')]
+    def plan(self, params, targets=None, force=(), fingerprints=None):
+        if fingerprints is None:
+            fingerprints = self.fingerprints(params, targets)
+        plan = []
+        for name, fingerprint in fingerprints.items():
+            fresh = (name not in force
+                     and self.stored_fingerprint(name) == fingerprint)
+            plan.append((name, 'cached' if fresh else 'rebuild'))
+
+        return plan
+
+    def load(self, name):
+        with open(self._output_file(name), 'rb') as f:
+            return pickle.load(f)
+
+    def save(self, name, fingerprint, output):
+        os.makedirs(self.directory, exist_ok=True)
+        fname = self._output_file(name)
+        with open(fname + '.tmp', 'wb') as f:
+            pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(fname + '.tmp', fname)
+        with open(self._manifest_file(name), 'w') as f:
+            json.dump({'stage': name, 'fingerprint': fingerprint}, f)
+
+    # run the targets (all stages by default) and return their outputs;
+    # cached stages are only loaded when a target or a rebuild needs them.
+    # profile names a stage to run under cProfile (default: the
+    # UNI_RD_PROFILE environment variable)
+    def run(self, params, targets=None, force=(), dry_run=False,
+            profile=None, report_dir=None):
+        fingerprints = self.fingerprints(params, targets)
+        plan = self.plan(params, targets, force, fingerprints)
+        if dry_run:
+            return plan
+
+        profile = profile or os.environ.get('UNI_RD_PROFILE')
+        targets = list(self.stages) if targets is None else targets
+        rebuild = {name for name, status in plan if status == 'rebuild'}
+        outputs = {}
+        self.report = instrument.RunReport(params)
+
+        def get(name):
+            if name not in outputs:
+                with instrument.Measurement(name, status='cached') as m:
+                    outputs[name] = m.output(self.load(name))
+                self.report.add(m)
+            return outputs[name]
+
+        try:
+            for name, _ in plan:
+                if name not in rebuild:
+                    continue
+                stage = self.stages[name]
+                kwargs = {p: params[p] for p in stage.params}
+                for arg, dep in stage.deps.items():
+                    kwargs[arg] = get(dep)
+                measurement = instrument.Measurement(
+                    name, inputs=[kwargs[arg] for arg in stage.deps],
+                    profile=(name == profile))
+                try:
+                    with measurement:
+                        outputs[name] = measurement.output(
+                            stage.func(**kwargs))
+                finally:
+                    self.report.add(measurement)
+                self.save(name, fingerprints[name], outputs[name])
+
+            return {name: get(name) for name in targets}
+        finally:
+            self.report_file = self.report.write(report_dir)
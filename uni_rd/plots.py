@@ -0,0 +1,87 @@
+import os
+
+import matplotlib
+import matplotlib.pyplot as plt
+
+from uni_rd import keys
+from uni_rd.config import path
+
+# the plots are written to files, never shown
+matplotlib.use('Agg')
+
+png_dir = os.path.join(path, 'static png')
+
+
+# fund per county and year next to the county's population and income
+# (same table the presentation notebook builds)
+def get_fund_county(uni_df, uni_counties, df):
+    uni_filter = uni_counties.loc[uni_counties['IPEDSID']
+                                  .isin(uni_df['IPEDSID']),
+                                  ['IPEDSID', 'COUNTYFIPS']]
+    all_data = keys.join(uni_df, uni_filter,
+                         keys.frame_key(uni_df, 'IPEDSID', None),
+                         keys.frame_key(uni_filter, 'IPEDSID', None),
+                         shared=['IPEDSID'])
+    all_data['year'] = all_data['year'].astype(int)
+    all_data = keys.join(all_data, df, keys.frame_key(all_data),
+                         keys.frame_key(df), equal=['state'],
+                         shared=['year', 'COUNTYFIPS'])
+
+    fund_county = (all_data.groupby(['year', 'COUNTYFIPS', 'state', 'county',
+                                     'total_population', 'total_native',
+                                     'total_born_in_state',
+                                     'total_born_out_state',
+                                     'total_born_outside_US',
+                                     'total_foreign_born',
+                                     'income_past12m'])['fund']
+                   .sum().reset_index())
+
+    # create column for share of foreigner
+    fund_county['share_foreigner'] = (fund_county['total_foreign_born']
+                                      / fund_county['total_population'])
+
+    return fund_county
+
+
+# create plot with multiple lines, one per county
+def plot_multiline(df, xaxis, yaxis, hue, title):
+    fig, ax = plt.subplots(figsize=(12, 10))
+    markers = 'osD^v<>ph*'
+    for i, (label, group) in enumerate(df.sort_values(xaxis).groupby(hue)):
+        ax.plot(group[xaxis], group[yaxis], marker=markers[i % len(markers)],
+                label=label)
+    ax.grid(True, color='0.9')
+    ax.legend(loc='center left', bbox_to_anchor=(1.00, 0.5), ncol=1)
+    ax.set(title=title, xlabel=xaxis, ylabel='natural units')
+
+    return ax
+
+
+trend_plots = [('fund_trend', 'fund',
+                'Total Fund Based on County: Growth Trend'),
+               ('income_trend', 'income_past12m',
+                '12 Month Income: Growth Trend'),
+               ('foreigner_share_trend', 'share_foreigner',
+                'Share of Foreigner: Growth Trend')]
+
+
+# save the static trend plots, returns the written files
+def save_trend_plots(fund_county, outdir=png_dir):
+    os.makedirs(outdir, exist_ok=True)
+    files = []
+    for name, column, title in trend_plots:
+        graph = plot_multiline(fund_county, 'year', column, 'county', title)
+        fname = os.path.join(outdir, f'{name}.png')
+        graph.figure.savefig(fname, bbox_inches='tight')
+        plt.close(graph.figure)
+        files.append(fname)
+
+    return files
+
+
+# plots stage: fund by county and the three trend pngs
+def make_trend_plots(uni_df, uni_counties, df, outdir=png_dir):
+    fund_county = get_fund_county(uni_df, uni_counties, df)
+    files = save_trend_plots(fund_county, outdir)
+
+    return {'fund_county': fund_county, 'files': files}
@@ -0,0 +1,19 @@
+from uni_rd.fixed_effects import fe_regression
+
+# outcomes regressed on the R&D fund
+outcomes = {'income': 'income_past12m',
+            'population': 'total_population',
+            'outstate': 'total_born_out_state',
+            'foreigner': 'total_foreign_born'}
+
+
+# summary statistics and one fixed-effects fit for all outcomes at once;
+# absorb the year (default), county or institution effects and cluster
+# the standard errors by institution
+def get_regression_results(reg_data, absorb=('year',), cluster='IPEDSID'):
+    summary_stats = reg_data.groupby('year').describe()
+
+    fit = fe_regression(reg_data, list(outcomes.values()), ['fund'],
+                        absorb=absorb, cluster=cluster)
+
+    return {'summary_stats': summary_stats, 'fit': fit}
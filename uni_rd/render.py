@@ -0,0 +1,248 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from matplotlib.collections import PolyCollection
+
+from uni_rd import plots
+from uni_rd.dashboard import DashboardData, map_format
+from uni_rd.pipeline import source_digest
+
+# the charts are only written to files, in the workers as well
+matplotlib.use('Agg')
+
+# Every static chart at once: a choropleth per state and metric, the
+# trend plots of each state's university counties and one chart per
+# county, rendered on a process pool. The data (cubes, county topology,
+# campuses) is loaded once in the parent; on fork the workers inherit it
+# without copying, elsewhere it goes to each worker once. Every output
+# is keyed by a hash of the data it is drawn from (and of this module),
+# kept in a manifest next to the pngs, so a rerun only draws what changed.
+#
+#     python -m uni_rd.render --year 2019
+
+batch_dir = os.path.join(plots.png_dir, 'batch')
+manifest_name = 'render_manifest.json'
+kinds = ('map', 'trend', 'county')
+county_columns = ['year', 'share_foreigner', 'income_past12m', 'fund']
+county_titles = {'share_foreigner': 'Share of Foreigner',
+                 'income_past12m': 'Income in Past 12 Months',
+                 'fund': 'R&D Fund'}
+
+
+def input_hash(*parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            if part.dtype.kind in 'OUS':
+                part = '\x1f'.join(map(str, part))
+            else:
+                digest.update(np.ascontiguousarray(part).tobytes())
+                continue
+        digest.update(repr(part).encode('utf-8'))
+        digest.update(b'\x1e')
+
+    return digest.hexdigest()
+
+
+def file_name(*parts):
+    return os.path.join(*[str(p).replace(' ', '_').replace('/', '-')
+                          for p in parts])
+
+
+# (job, output file, input hash) of every chart; job is what a worker
+# gets: ('map', state, field, year), ('trend', state, column) or
+# ('county', state, county)
+def plan_jobs(data, year=None, which=kinds):
+    year = data.years[1] if year is None else year
+    code = source_digest(plan_jobs) + source_digest(plots.plot_multiline)
+    topology = input_hash(*data.topology.arcs[data.level], data.level)
+    jobs = []
+    if 'map' in which:
+        for state in data.county_cube.states:
+            unis = data.universities[data.universities['state'] == state]
+            campuses = input_hash(unis['IPEDSID'].to_numpy(),
+                                  unis['year'].to_numpy(),
+                                  unis['fund'].to_numpy('float64'))
+            for field in map_format['field']:
+                values = data.county_cube.state_series(
+                    state, ['COUNTYFIPS', 'year', field])
+                jobs.append((('map', state, field, year),
+                             file_name(state, f'map_{field}_{year}.png'),
+                             input_hash(code, topology, campuses, year,
+                                        *values.values())))
+    if 'trend' in which:
+        for state in data.fund_cube.states:
+            for name, column, _ in plots.trend_plots:
+                values = data.fund_cube.state_series(
+                    state, ['year', 'county', column])
+                jobs.append((('trend', state, column),
+                             file_name(state, f'{name}.png'),
+                             input_hash(code, *values.values())))
+    if 'county' in which:
+        for state, counties in data.fund_cube.counties.items():
+            for county in counties:
+                values = data.fund_cube.series(state, county, county_columns)
+                jobs.append((('county', state, county),
+                             file_name(state, 'counties', f'{county}.png'),
+                             input_hash(code, *values.values())))
+
+    return jobs
+
+
+def draw_state_map(data, state, field, year):
+    spec = map_format.set_index('field').loc[field]
+    geometry = data.state_geometry(state)
+    values = data.map_values(state, year, field)
+    polygons, colors = [], []
+    for xs, ys, value in zip(geometry['xs'], geometry['ys'], values):
+        cuts = np.flatnonzero(np.isnan(xs))
+        for x, y in zip(np.split(xs, cuts), np.split(ys, cuts)):
+            keep = ~np.isnan(x)
+            polygons.append(np.column_stack([x[keep], y[keep]]))
+            colors.append(value)
+
+    fig, ax = plt.subplots(figsize=(12, 12))
+    counties = PolyCollection(polygons, cmap='OrRd', edgecolors='black',
+                              linewidths=0.3)
+    counties.set_array(np.ma.masked_invalid(colors))
+    ax.add_collection(counties)
+    campuses = data.campuses(state, year)
+    ax.scatter(campuses['x'], campuses['y'], color='red', s=20, alpha=0.7)
+    ax.autoscale_view()
+    # degrees of longitude shrink with latitude
+    ax.set_aspect(1 / np.cos(np.radians(np.mean(ax.get_ylim()))))
+    ax.set_axis_off()
+    fig.colorbar(counties, ax=ax, shrink=0.6, label=spec['verbage'])
+    ax.set_title(f"{state}: {spec['verbage']}, {year}")
+
+    return fig
+
+
+def draw_state_trend(data, state, column):
+    title = dict((c, t) for _, c, t in plots.trend_plots)[column]
+    df = pd.DataFrame(data.fund_cube.state_series(
+        state, ['year', 'county', column]))
+    graph = plots.plot_multiline(df, 'year', column, 'county',
+                                 f'{state}: {title}')
+
+    return graph.figure
+
+
+def draw_county(data, state, county):
+    series = data.fund_cube.series(state, county, county_columns)
+    fig, axes = plt.subplots(3, 1, figsize=(8, 10), sharex=True)
+    for ax, column in zip(axes, county_columns[1:]):
+        ax.plot(series['year'], series[column], marker='o')
+        ax.grid(True, color='0.9')
+        ax.set(title=county_titles[column])
+    axes[-1].set(xlabel='year')
+    fig.suptitle(f'{county}, {state}')
+
+    return fig
+
+
+draw = {'map': draw_state_map, 'trend': draw_state_trend,
+        'county': draw_county}
+
+_data = None
+
+
+def _init_worker(fund_cube, county_cube, topology, universities, level):
+    global _data
+    _data = DashboardData(fund_cube, county_cube, topology, universities,
+                          level=level)
+
+
+def _render(job, fname):
+    fig = draw[job[0]](_data, *job[1:])
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    fig.savefig(fname, bbox_inches='tight')
+    plt.close(fig)
+
+    return fname
+
+
+def read_manifest(outdir):
+    try:
+        with open(os.path.join(outdir, manifest_name)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_manifest(outdir, manifest):
+    fname = os.path.join(outdir, manifest_name)
+    os.makedirs(outdir, exist_ok=True)
+    with open(fname + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=0, sort_keys=True)
+    os.replace(fname + '.tmp', fname)
+
+
+# draw every chart whose inputs changed since the last run (all with
+# force); returns the written and the skipped files
+def render_all(data, outdir=batch_dir, year=None, which=kinds, workers=None,
+               force=False, progress=False):
+    jobs = plan_jobs(data, year, which)
+    manifest = read_manifest(outdir)
+    todo, skipped = [], []
+    for job, name, digest in jobs:
+        if (force or manifest.get(name) != digest
+                or not os.path.exists(os.path.join(outdir, name))):
+            todo.append((job, name, digest))
+        else:
+            skipped.append(os.path.join(outdir, name))
+
+    written = []
+    if todo:
+        workers = workers or os.cpu_count() or 1
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context(
+            'fork' if 'fork' in methods else None)
+        shared = (data.fund_cube, data.county_cube, data.topology,
+                  data.universities, data.level)
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                     initializer=_init_worker,
+                                     initargs=shared) as pool:
+                futures = {pool.submit(_render, job,
+                                       os.path.join(outdir, name)):
+                           (name, digest) for job, name, digest in todo}
+                for future in as_completed(futures):
+                    name, digest = futures[future]
+                    written.append(future.result())
+                    manifest[name] = digest
+                    if progress:
+                        print(f'\r{len(written)}/{len(todo)} charts', end='',
+                              file=sys.stderr)
+        finally:
+            write_manifest(outdir, manifest)
+            if progress:
+                print(file=sys.stderr)
+
+    return {'written': written, 'skipped': skipped}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='render the static per-state and per-county charts')
+    parser.add_argument('--outdir', default=batch_dir)
+    parser.add_argument('--year', type=int)
+    parser.add_argument('--kinds', nargs='+', choices=kinds, default=kinds)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--force', action='store_true')
+    args = parser.parse_args()
+
+    result = render_all(DashboardData.from_pipeline(), args.outdir,
+                        args.year, args.kinds, args.workers, args.force,
+                        progress=True)
+    print(f"{len(result['written'])} written, "
+          f"{len(result['skipped'])} unchanged")
@@ -0,0 +1,314 @@
+import argparse
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import us
+from scipy.spatial import cKDTree
+
+from uni_rd import census, instrument
+from uni_rd.acs import build_acs_frame, income_columns, population_columns
+from uni_rd.config import cache_dir
+from uni_rd.exposure import institution_points, projection
+
+# ACS below the county: tracts (~85k a year) and block groups (~240k).
+# The API only serves them within one state, so they are fetched state by
+# state as a stream of (year, state, frame) chunks, a few requests in
+# flight, each chunk written to disk as it arrives and folded into an
+# aggregator (counties, or zones around each campus) before the next one
+# is taken. Memory is one state's chunk plus the aggregate, however many
+# geographies and years are asked for.
+#
+#     chunks = write_chunks(stream_chunks('tract', range(2015, 2020)),
+#                           'tract')
+#     df = aggregate(chunks, CountyAggregator())
+#
+#     python -m uni_rd.small_area --level 'block group' --ystart 2015
+
+small_area_dir = os.path.join(cache_dir, 'small_area')
+
+LEVELS = ('tract', 'block group')
+
+columns = {**population_columns, **income_columns}
+# per capita income is averaged weighted by population, the counts summed
+weighted = {'income_past12m': 'total_population'}
+
+# contiguous states by FIPS, as the county frames are
+contiguous_fips = [state.fips for state in us.STATES_CONTIGUOUS]
+
+
+def state_geo(level, state):
+    if level not in LEVELS:
+        raise ValueError(f'unknown level {level!r}, one of {LEVELS}')
+    geo = [('state', state), ('county', '*'), ('tract', '*')]
+    return geo if level == 'tract' else geo + [('block group', '*')]
+
+
+# one (year, state) of raw download in the project layout, typed; the API
+# marks suppressed estimates with large negative numbers, those are NaN
+def build_chunk(data, year):
+    frame = build_acs_frame(data, columns, year)
+    frame['year'] = frame['year'].astype('int16')
+    for column in ['state', 'county']:
+        frame[column] = frame[column].astype('category')
+    for column in columns.values():
+        values = frame[column].to_numpy(dtype='float64', na_value=np.nan)
+        frame[column] = np.where(values < 0, np.nan, values)
+
+    return frame
+
+
+# (year, state, chunk) for every year and state, in that order; at most
+# max_workers requests are in flight and nothing is fetched ahead of them
+def stream_chunks(level, years, states=None, dataset='acs5', max_workers=8,
+                  cache=None, offline=None, base_url=None, key=None):
+    states = contiguous_fips if states is None else states
+    jobs = iter([(year, state) for year in years for state in states])
+
+    def fetch(job):
+        year, state = job
+        data = census.download_years(dataset, [year],
+                                     state_geo(level, state), [*columns],
+                                     max_workers=1, cache=cache,
+                                     offline=offline, base_url=base_url,
+                                     key=key)[year]
+        return build_chunk(data, year)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = deque((job, pool.submit(fetch, job))
+                        for job in itertools.islice(jobs, max_workers))
+        while pending:
+            job, future = pending.popleft()
+            chunk = future.result()
+            following = next(jobs, None)
+            if following is not None:
+                pending.append((following, pool.submit(fetch, following)))
+            instrument.count('small_area_rows', len(chunk))
+            yield job[0], job[1], chunk
+
+
+def level_dir(level, directory=None):
+    return os.path.join(directory or small_area_dir,
+                        level.replace(' ', '_'))
+
+
+def chunk_file(level, year, state, directory=None):
+    return os.path.join(level_dir(level, directory), f'year={int(year)}',
+                        f'state={state}.arrow')
+
+
+# write each chunk as one Arrow file while passing it on
+def write_chunks(chunks, level, directory=None):
+    for year, state, chunk in chunks:
+        fname = chunk_file(level, year, state, directory)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        with pa.OSFile(fname + '.tmp', 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(fname + '.tmp', fname)
+        yield year, state, chunk
+
+
+# the stored chunks again (memory-mapped, one at a time), so the
+# aggregation can be redone without the API
+def read_chunks(level, years=None, states=None, directory=None):
+    root = level_dir(level, directory)
+    stored = sorted(int(d[len('year='):]) for d in os.listdir(root)
+                    if d.startswith('year='))
+    for year in stored if years is None else years:
+        year_dir = os.path.join(root, f'year={int(year)}')
+        names = sorted(os.listdir(year_dir)) if states is None else \
+            [f'state={state}.arrow' for state in states]
+        for name in names:
+            if not name.endswith('.arrow'):
+                continue
+            source = pa.memory_map(os.path.join(year_dir, name), 'r')
+            chunk = pa.ipc.open_file(source).read_all().to_pandas()
+            yield year, name[len('state='):-len('.arrow')], chunk
+
+
+# what every geography of a chunk adds to its county or zone: the
+# counts, value x weight and weight of the weighted columns (both only
+# where the value is known) and 1 geography
+def contributions(chunk):
+    data = chunk[list(columns.values())].copy()
+    for column, weight in weighted.items():
+        known = data[column].notna() & data[weight].notna()
+        data[column] = (data[column] * data[weight]).where(known)
+        data[f'{column}_weight'] = data[weight].where(known)
+    data['geographies'] = 1
+
+    return data
+
+
+def _finish(sums):
+    for column in weighted:
+        sums[column] = sums[column] / sums.pop(f'{column}_weight')
+    return sums
+
+
+# roll-up to counties, in the layout of acs.get_county_df; a county never
+# spans two states, so each chunk is finished on its own and only the
+# county rows are kept
+class CountyAggregator:
+    keys = ['year', 'state', 'county', 'county_id', 'state_id',
+            'COUNTYFIPS']
+
+    def __init__(self):
+        self.parts = []
+
+    # grouped on the county code alone, the other keys taken from the
+    # first geography of each county
+    def add(self, chunk):
+        codes, _ = pd.factorize(chunk['COUNTYFIPS'])
+        _, first = np.unique(codes, return_index=True)
+        sums = contributions(chunk).groupby(codes).sum(min_count=1)
+        keys = chunk[self.keys].iloc[first].reset_index(drop=True)
+        self.parts.append(pd.concat([keys, _finish(sums)], axis=1))
+
+    def result(self):
+        if not self.parts:
+            return pd.DataFrame(columns=[*self.keys, 'geographies',
+                                         *columns.values()])
+        df = pd.concat(self.parts, ignore_index=True)
+        for column in ['state', 'county']:
+            df[column] = df[column].astype(str)
+        df['year'] = df['year'].astype('int64')
+        df['geographies'] = df['geographies'].astype('int64')
+
+        return df.sort_values(['year', 'COUNTYFIPS'], ignore_index=True)
+
+
+# GEOID and projected representative point of every tract/block group in
+# the given shape files (e.g. the per-state cb_<year>_<state>_tract_500k)
+def geography_points(fnames):
+    parts = []
+    for fname in [fnames] if isinstance(fnames, str) else fnames:
+        shapes = gpd.read_file(fname, columns=['GEOID'], engine='pyogrio')
+        points = shapes.geometry.representative_point().to_crs(projection)
+        parts.append(pd.DataFrame({'GEOID': shapes['GEOID'].to_numpy(),
+                                   'x': points.x.to_numpy(),
+                                   'y': points.y.to_numpy()}))
+
+    return pd.concat(parts, ignore_index=True)
+
+
+# roll-up to a zone of radius_km around every campus: each geography
+# whose point lies within the radius adds to the zone of that campus
+# (zones overlap where campuses are close). The sums are one array per
+# year, campuses x variables, added to in place.
+class ZoneAggregator:
+    def __init__(self, points, uni_lookup, radius_km=25):
+        points = points.sort_values('GEOID')
+        self.geoids = points['GEOID'].to_numpy().astype(str)
+        self.xy = points[['x', 'y']].to_numpy()
+        located = uni_lookup.drop_duplicates('IPEDSID')
+        located = located.dropna(subset=['lon', 'lat'])
+        self.ipedsids = located['IPEDSID'].to_numpy()
+        # no tree without campuses (a state with none); nothing is added
+        self.tree = (cKDTree(institution_points(located))
+                     if len(located) else None)
+        self.radius = radius_km * 1000
+        self.names = None
+        self.sums = {}
+
+    def add(self, chunk):
+        if self.tree is None or not len(self.geoids):
+            return
+        geoids = chunk['GEOID'].to_numpy().astype(str)
+        position = np.searchsorted(self.geoids, geoids)
+        position = np.minimum(position, len(self.geoids) - 1)
+        found = self.geoids[position] == geoids
+        instrument.count('small_area_unlocated', int((~found).sum()))
+
+        near = self.tree.query_ball_point(self.xy[position[found]],
+                                          self.radius)
+        lengths = np.fromiter(map(len, near), dtype='int64', count=len(near))
+        if not lengths.sum():
+            return
+        rows = np.repeat(np.flatnonzero(found), lengths)
+        campuses = np.concatenate([n for n in near if n]).astype('int64')
+
+        values = contributions(chunk.iloc[rows])
+        self.names = list(values.columns)
+        values = np.nan_to_num(values.to_numpy())
+        years = chunk['year'].to_numpy()[rows]
+        for year in np.unique(years):
+            total = self.sums.setdefault(
+                int(year), np.zeros((len(self.ipedsids), len(self.names))))
+            mask = years == year
+            np.add.at(total, campuses[mask], values[mask])
+
+    # one row per campus and year; no rows (same columns) when nothing
+    # was added, no points, no campuses or no campus near any point
+    def result(self):
+        frames = []
+        for year, total in sorted(self.sums.items()):
+            frame = pd.DataFrame(total, columns=self.names)
+            frame.insert(0, 'IPEDSID', self.ipedsids)
+            frame.insert(0, 'year', year)
+            frames.append(_finish(frame))
+        if not frames:
+            frame = contributions(pd.DataFrame(columns=list(columns.values()),
+                                               dtype='float64'))
+            frame.insert(0, 'IPEDSID', self.ipedsids[:0])
+            frame.insert(0, 'year', np.array([], dtype='int64'))
+            frames.append(_finish(frame))
+        df = pd.concat(frames, ignore_index=True)
+        df['geographies'] = df['geographies'].astype('int64')
+
+        return df
+
+
+def aggregate(chunks, aggregator):
+    for _, _, chunk in chunks:
+        aggregator.add(chunk)
+
+    return aggregator.result()
+
+
+# county panel built from tracts or block groups, for ystart to yend,
+# stored chunk by chunk on the way
+def get_small_area_county_df(ystart, yend, level='tract', states=None,
+                             directory=None):
+    chunks = stream_chunks(level, range(ystart, yend), states)
+
+    return aggregate(write_chunks(chunks, level, directory),
+                     CountyAggregator())
+
+
+# campus zone panel (year, IPEDSID, sums over the zone) from tracts or
+# block groups with their points from the given shape files
+def get_small_area_zone_df(ystart, yend, uni_lookup, point_files,
+                           level='tract', radius_km=25, states=None,
+                           directory=None):
+    zones = ZoneAggregator(geography_points(point_files), uni_lookup,
+                           radius_km)
+    chunks = stream_chunks(level, range(ystart, yend), states)
+
+    return aggregate(write_chunks(chunks, level, directory), zones)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='fetch tract/block group ACS state by state and roll '
+                    'it up to counties')
+    parser.add_argument('--level', choices=LEVELS, default='tract')
+    parser.add_argument('--ystart', type=int, default=2010)
+    parser.add_argument('--yend', type=int, default=2020)
+    parser.add_argument('--states', nargs='+', help='state FIPS codes')
+    parser.add_argument('--out', help='csv of the county roll-up')
+    args = parser.parse_args()
+
+    df = get_small_area_county_df(args.ystart, args.yend, args.level,
+                                  args.states)
+    if args.out:
+        df.to_csv(args.out, index=False)
+    print(f'{len(df)} county rows from {args.level} chunks under '
+          f'{level_dir(args.level)}')
@@ -0,0 +1,87 @@
+import os
+
+from uni_rd.config import county_shp, herd_file, uni_shp
+from uni_rd.pipeline import Pipeline, Stage
+
+# the project pipeline: census fetch, HERD parse, university geo-lookup,
+# panel merge, spatial fund exposure, regression, resampling inference,
+# the specification sweep, the dashboard cube and county topology, and
+# plots. Stage functions are named as 'module:function', so a stage's
+# module (geopandas, statsmodels, matplotlib, ...) is only imported when
+# that stage runs.
+STAGES = [
+    Stage('census', 'uni_rd.acs:get_county_df', params=['ystart', 'yend']),
+    Stage('herd', 'uni_rd.herd:get_uni_fund',
+          params=['ystart', 'yend', 'nuni', 'rank_by'],
+          files=[herd_file]),
+    Stage('herd_all', 'uni_rd.herd:get_all_fund',
+          params=['ystart', 'yend', 'rank_by'], files=[herd_file]),
+    Stage('uni_counties', 'uni_rd.universities:get_uni_counties',
+          files=[os.path.dirname(uni_shp), os.path.dirname(county_shp)]),
+    Stage('panel', 'uni_rd.universities:get_regression_data',
+          deps={'top_uni': 'herd', 'df_variables': 'census',
+                'uni_counties': 'uni_counties'}),
+    Stage('panel_all', 'uni_rd.universities:get_regression_data',
+          deps={'top_uni': 'herd_all', 'df_variables': 'census',
+                'uni_counties': 'uni_counties'}),
+    Stage('exposure', 'uni_rd.exposure:get_fund_exposure',
+          deps={'uni_df': 'herd_all', 'uni_lookup': 'uni_counties'},
+          params=['max_km', 'kernel', 'bandwidth'],
+          files=[os.path.dirname(county_shp)]),
+    Stage('regression', 'uni_rd.regression:get_regression_results',
+          deps={'reg_data': 'panel'}, params=['absorb', 'cluster']),
+    Stage('inference', 'uni_rd.inference:get_inference_results',
+          deps={'reg_data': 'panel'},
+          params=['absorb', 'cluster', 'reps', 'seed']),
+    Stage('sweep', 'uni_rd.sweep:get_sweep_results',
+          deps={'reg_data': 'panel_all'},
+          params=['absorb', 'cluster', 'lags', 'transforms', 'subsamples',
+                  'top_n'],
+          files=[herd_file]),
+    Stage('cube', 'uni_rd.cube:get_panel_cube',
+          deps={'uni_df': 'herd_all', 'uni_counties': 'uni_counties',
+                'df': 'census'}),
+    Stage('topology', 'uni_rd.topology:get_county_topology',
+          files=[os.path.dirname(county_shp)]),
+    Stage('plots', 'uni_rd.plots:make_trend_plots',
+          deps={'uni_df': 'herd', 'uni_counties': 'uni_counties',
+                'df': 'census'}),
+]
+
+# nuni cuts the herd stage to the top 50 institutions, as the script
+# always did (None for every one, about 900): the regression panel, its
+# inference and the trend plots. Exposure, the sweep and the dashboard
+# cube cover every institution (herd_all, panel_all) whatever nuni is.
+# rank_by is a year or a list of years whose fund is summed; absorb
+# lists the fixed effects of the regression and cluster the level of the
+# cluster-robust standard errors; reps and seed are for the
+# bootstrap/permutation inference; max_km, kernel and bandwidth (km)
+# define the distance-weighted fund exposure; lags (years), transforms
+# ('levels', 'log'), subsamples ('all', a census region or a state) and
+# top_n (None for every institution, the cutoffs ranked over the whole
+# HERD file) span the specification sweep (the defaults of sweep.py,
+# spelled out so this module imports nothing heavy)
+default_params = {'ystart': 2010, 'yend': 2020, 'nuni': 50,
+                  'rank_by': 2010, 'absorb': ['year'], 'cluster': 'IPEDSID',
+                  'reps': 1000, 'seed': 0, 'max_km': 100,
+                  'kernel': 'exponential', 'bandwidth': 50,
+                  'lags': [0, 1, 2, 3, 4, 5],
+                  'transforms': ['levels', 'log'],
+                  'subsamples': ['all', 'Northeast', 'Midwest', 'South',
+                                 'West'],
+                  'top_n': [None, 50, 100, 200]}
+
+
+def get_pipeline():
+    return Pipeline(STAGES)
+
+
+# print what would be rebuilt without running anything, and return that
+# plan as (stage, status) pairs
+def print_plan(params=None, targets=None, force=(), pipeline=None):
+    params = {**default_params, **(params or {})}
+    plan = (pipeline or get_pipeline()).plan(params, targets, force)
+    for name, status in plan:
+        print(f'{name:<14}{status}')
+
+    return plan
@@ -0,0 +1,129 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from uni_rd.config import refined_data
+
+# typed, year-partitioned columnar copies of the refined data frames.
+# Every year is one uncompressed Arrow IPC (Feather v2) file,
+#     refined_data/columnar/<name>/year=2015.arrow
+# so readers memory-map the file, take only the columns they ask for and
+# skip the years they don't need, instead of parsing the whole CSV.
+# FIPS/ID codes are stored as fixed-width strings, so the leading zeros
+# survive and nobody has to rebuild GEOID with '{0:05}'.format.
+
+store_dir = os.path.join(refined_data, 'columnar')
+
+state_type = pa.dictionary(pa.int8(), pa.string())
+
+SCHEMAS = {
+    'df_income_pop': pa.schema([
+        ('year', pa.int16()),
+        ('state', state_type),
+        ('county', pa.string()),
+        ('county_id', pa.string()),
+        ('state_id', pa.string()),
+        ('COUNTYFIPS', pa.string()),
+        ('total_population', pa.int32()),
+        ('total_native', pa.int32()),
+        ('total_born_in_state', pa.int32()),
+        ('total_born_out_state', pa.int32()),
+        ('total_born_outside_US', pa.int32()),
+        ('total_foreign_born', pa.int32()),
+        ('income_past12m', pa.float64())]),
+    'uni_fund_df': pa.schema([
+        ('year', pa.int16()),
+        ('state', state_type),
+        ('IPEDSID', pa.string()),
+        ('fund', pa.float64())]),
+}
+
+# width of the zero padded code columns
+FIXED_WIDTH = {'county_id': 3, 'state_id': 2, 'COUNTYFIPS': 5,
+               'IPEDSID': 6}
+
+
+def dataset_dir(name):
+    return os.path.join(store_dir, name)
+
+
+def year_file(name, year):
+    return os.path.join(dataset_dir(name), f'year={int(year)}.arrow')
+
+
+def stored_years(name):
+    directory = dataset_dir(name)
+    if not os.path.isdir(directory):
+        return []
+    years = [int(f[len('year='):-len('.arrow')])
+             for f in os.listdir(directory)
+             if f.startswith('year=') and f.endswith('.arrow')]
+
+    return sorted(years)
+
+
+# cast a frame to the declared schema, padding the code columns that lost
+# their leading zeros somewhere (e.g. a CSV round trip); a missing count
+# (a suppressed estimate) goes through the nullable integer type and is
+# stored as an Arrow null
+def to_table(df, schema):
+    df = df.copy()
+    for field in schema:
+        column = df[field.name]
+        if field.name in FIXED_WIDTH:
+            column = column.astype(str).str.replace(r'\.0$', '', regex=True)
+            column = column.str.zfill(FIXED_WIDTH[field.name])
+        elif pa.types.is_integer(field.type):
+            dtype = np.dtype(field.type.to_pandas_dtype()).name
+            column = pd.to_numeric(column).astype(dtype.capitalize())
+        df[field.name] = column
+
+    return pa.Table.from_pandas(df[schema.names], schema=schema,
+                                preserve_index=False)
+
+
+# write (or overwrite) one dataset, one file per year
+def write_dataset(df, name, schema=None):
+    schema = schema or SCHEMAS[name]
+    os.makedirs(dataset_dir(name), exist_ok=True)
+    years = pd.to_numeric(df['year']).astype(int)
+    for year in np.unique(years):
+        table = to_table(df[years == year], schema)
+        fname = year_file(name, year)
+        tmp = fname + '.tmp'
+        with pa.OSFile(tmp, 'wb') as sink:
+            with pa.ipc.new_file(sink, schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, fname)
+
+
+# read a dataset back as arrow, only the requested columns and years;
+# the files are memory-mapped so nothing is copied until it is used
+def read_table(name, columns=None, years=None):
+    schema = SCHEMAS.get(name)
+    available = stored_years(name)
+    if years is not None:
+        years = {int(year) for year in years}
+        available = [year for year in available if year in years]
+
+    tables = []
+    for year in available:
+        source = pa.memory_map(year_file(name, year), 'r')
+        table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select(list(columns))
+        tables.append(table)
+
+    if not tables:
+        if schema is None:
+            raise FileNotFoundError(f'no columnar data stored for {name}')
+        empty = schema.empty_table()
+        return empty.select(list(columns)) if columns is not None else empty
+
+    return pa.concat_tables(tables, promote_options='permissive')
+
+
+def read_dataset(name, columns=None, years=None):
+    return read_table(name, columns, years).to_pandas()
@@ -0,0 +1,294 @@
+import itertools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import us
+from scipy import stats
+
+from uni_rd import herd, keys
+from uni_rd.config import herd_file
+from uni_rd.fixed_effects import FixedEffects, solve_demeaned
+from uni_rd.regression import outcomes
+
+# Specification sweep of the fund regressions: every combination of fund
+# lag, levels or logs, state/region subsample and top-N institutions,
+# all outcomes of a specification in one fixed-effects fit. Everything a
+# fit needs is built once as numpy arrays (outcomes and lagged fund in
+# levels and logs, fixed-effect and cluster codes, one row mask per
+# subsample and cutoff); a specification only picks a mask and columns.
+# The arrays go to every worker process once, the specifications are
+# sent in chunks, and the coefficients come back as one tidy table.
+#
+#     table = run_sweep(reg_data, lags=range(6), top_n=[None, 50, 100])
+
+# census regions by state name
+regions = {
+    'Northeast': ['Connecticut', 'Maine', 'Massachusetts', 'New Hampshire',
+                  'Rhode Island', 'Vermont', 'New Jersey', 'New York',
+                  'Pennsylvania'],
+    'Midwest': ['Illinois', 'Indiana', 'Michigan', 'Ohio', 'Wisconsin',
+                'Iowa', 'Kansas', 'Minnesota', 'Missouri', 'Nebraska',
+                'North Dakota', 'South Dakota'],
+    'South': ['Delaware', 'District of Columbia', 'Florida', 'Georgia',
+              'Maryland', 'North Carolina', 'South Carolina', 'Virginia',
+              'West Virginia', 'Alabama', 'Kentucky', 'Mississippi',
+              'Tennessee', 'Arkansas', 'Louisiana', 'Oklahoma', 'Texas'],
+    'West': ['Arizona', 'Colorado', 'Idaho', 'Montana', 'Nevada',
+             'New Mexico', 'Utah', 'Wyoming', 'Alaska', 'California',
+             'Hawaii', 'Oregon', 'Washington'],
+}
+
+default_lags = list(range(6))
+default_transforms = ['levels', 'log']
+default_subsamples = ['all', *regions]
+default_top_n = [None, 50, 100, 200]
+
+
+# state name of every row from the two state digits of COUNTYFIPS
+def state_names(fips):
+    names = {int(state.fips): state.name
+             for state in [*us.STATES_AND_TERRITORIES, us.states.DC]}
+    codes = keys.fips_values(fips) // 10 ** 4
+
+    return np.array([names.get(int(c), '') for c in codes], dtype=object)
+
+
+# the fund of every HERD institution and fiscal year (year, IPEDSID,
+# fund), so lags reach back before the first year of the panel
+def fund_history(fname=herd_file):
+    data = herd.read_herd(fname)
+    years = [c for c in data.columns if c not in ('state', 'IPEDSID')]
+
+    return data.melt(id_vars=['IPEDSID'], value_vars=years,
+                     var_name='year', value_name='fund')
+
+
+# fund of the same institution lag years earlier, looked up on the packed
+# year/IPEDSID key in history (fund_history; the panel itself when None,
+# then the first lag years of the panel have no lagged fund); NaN where
+# the institution has no fund that year
+def lagged_fund(df, lag, history=None):
+    if lag == 0:
+        return df['fund'].to_numpy('float64')
+    history = df if history is None else history
+    own = history.drop_duplicates(['year', 'IPEDSID'])
+    index = keys.KeyIndex(keys.uni_key(own['year'], own['IPEDSID']))
+    rows = index.lookup(keys.uni_key(df['year'].to_numpy() - lag,
+                                     df['IPEDSID']))
+    fund = own['fund'].to_numpy('float64')[np.maximum(rows, 0)]
+
+    return np.where(rows >= 0, fund, np.nan)
+
+
+# log of outcomes and log(1 + fund); non-positive values become NaN
+def log_values(values, plus_one=False):
+    values = np.asarray(values, dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logged = np.log1p(values) if plus_one else np.log(values)
+    return np.where(np.isfinite(logged), logged, np.nan)
+
+
+# IPEDSID of the institutions by total fund over the years of the panel,
+# largest first: of every institution in history (fund_history), so a
+# top n cutoff is one of the whole HERD file, or of the panel itself
+def fund_ranking(df, history=None):
+    if history is not None:
+        df = history[history['year'].isin(df['year'].unique())]
+        df = df.drop_duplicates(['year', 'IPEDSID'])
+    total = df.groupby('IPEDSID')['fund'].sum()
+
+    return total.sort_values(ascending=False, kind='stable').index
+
+
+class SweepData:
+    # y[transform]: rows x outcomes; x[(lag, transform)]: fund column;
+    # masks[(subsample, top_n)]: rows in the subsample and among the top
+    # n institutions (fund_ranking); a cutoff that keeps the same rows as
+    # an earlier one of the subsample (all of its institutions are in
+    # the top n) is left out, it would only fit that specification
+    # again; fe and clusters are integer codes
+    def __init__(self, y, x, masks, fe_codes, clusters, outcomes, absorb):
+        self.y = y
+        self.x = x
+        self.masks = masks
+        self.fe_codes = fe_codes
+        self.clusters = clusters
+        self.outcomes = outcomes
+        self.absorb = absorb
+
+    @classmethod
+    def from_frame(cls, df, outcome_columns, lags=default_lags,
+                   transforms=default_transforms,
+                   subsamples=default_subsamples, top_n=default_top_n,
+                   absorb=('year',), cluster='IPEDSID', history=None):
+        df = df.reset_index(drop=True)
+        levels = df[list(outcome_columns)].to_numpy('float64')
+        y = {'levels': levels, 'log': log_values(levels)}
+        y = {t: y[t] for t in transforms}
+        x = {}
+        for lag in lags:
+            fund = lagged_fund(df, lag, history)
+            for transform in transforms:
+                x[(lag, transform)] = (fund if transform == 'levels'
+                                       else log_values(fund, plus_one=True))
+
+        states = state_names(df['COUNTYFIPS'])
+        ranking = fund_ranking(df, history)
+        masks = {}
+        for subsample, n in itertools.product(subsamples, top_n):
+            if subsample == 'all':
+                rows = np.ones(len(df), dtype=bool)
+            else:
+                rows = np.isin(states, regions.get(subsample, [subsample]))
+            if n is not None:
+                rows &= df['IPEDSID'].isin(ranking[:n]).to_numpy()
+            if not any((rows == masks[(subsample, m)]).all()
+                       for m in top_n if (subsample, m) in masks):
+                masks[(subsample, n)] = rows
+
+        fe_codes = {name: pd.factorize(df[name], sort=True)[0]
+                    for name in absorb}
+        clusters = (pd.factorize(df[cluster], sort=True)[0]
+                    if cluster else None)
+
+        return cls(y, x, masks, fe_codes, clusters, list(outcome_columns),
+                   list(absorb))
+
+    def specifications(self):
+        lags = sorted({lag for lag, _ in self.x})
+        transforms = list(self.y)
+        return list(itertools.product(lags, transforms, self.masks))
+
+    # all outcomes of one specification, each on the rows where it, the
+    # fund and the fixed effects are known (as fe_regression does);
+    # outcomes missing on the same rows are fitted together. Outcomes
+    # whose rows cannot give standard errors (no residual degrees of
+    # freedom, or fewer than two clusters, e.g. a state subsample with a
+    # single institution) are left out; None when no outcome is left
+    def fit(self, lag, transform, mask):
+        y = self.y[transform]
+        x = self.x[(lag, transform)][:, None]
+        base = self.masks[mask] & np.isfinite(x[:, 0])
+        for name in self.absorb:
+            base &= self.fe_codes[name] >= 0
+        if self.clusters is not None:
+            base &= self.clusters >= 0
+        patterns, group = np.unique(np.isfinite(y), axis=1,
+                                    return_inverse=True)
+
+        frames = []
+        for g in range(patterns.shape[1]):
+            columns = np.flatnonzero(group.ravel() == g)
+            table = self._fit_rows(y[:, columns], x, base & patterns[:, g],
+                                   [self.outcomes[j] for j in columns])
+            if table is not None:
+                frames.append(table)
+        if not frames:
+            return None
+
+        return pd.concat(frames, ignore_index=True)
+
+    def _fit_rows(self, y, x, rows, outcomes):
+        nobs = int(rows.sum())
+        if nobs <= len(self.absorb) + 2:
+            return None
+
+        codes = pd.DataFrame({name: self.fe_codes[name][rows]
+                              for name in self.absorb})
+        fe = FixedEffects(codes, self.absorb)
+        if nobs - (1 + fe.dof) <= 0:
+            return None
+        clusters = None
+        if self.clusters is not None:
+            clusters = pd.factorize(self.clusters[rows])[0]
+            if clusters.max() < 1:
+                return None
+        demeaned = fe.demean(np.hstack([y[rows], x[rows]]))
+        coef, se, nobs, dof_resid, n_clusters = solve_demeaned(
+            demeaned[:, :-1], demeaned[:, -1:], fe.dof, clusters)
+
+        df = n_clusters - 1 if clusters is not None else dof_resid
+        t = coef[0] / se[0]
+        return pd.DataFrame({'outcome': outcomes, 'term': 'fund',
+                             'coef': coef[0], 'std_err': se[0], 't': t,
+                             'p_value': 2 * stats.t.sf(np.abs(t), df),
+                             'nobs': nobs, 'n_clusters': n_clusters})
+
+
+_data = None
+
+
+def _init_worker(data):
+    global _data
+    _data = data
+
+
+def _fit_chunk(specs):
+    frames = []
+    for lag, transform, (subsample, n) in specs:
+        table = _data.fit(lag, transform, (subsample, n))
+        if table is not None:
+            frames.append(table.assign(lag=lag, transform=transform,
+                                       subsample=subsample, top_n=n))
+
+    return frames
+
+
+# fit every specification, chunk_size specifications per task; one row
+# per (specification, outcome) with coef, std_err, t, p_value and nobs;
+# history (fund_history) gives the lagged fund before the panel's years
+def run_sweep(df, outcome_columns=None, lags=default_lags,
+              transforms=default_transforms, subsamples=default_subsamples,
+              top_n=default_top_n, absorb=('year',), cluster='IPEDSID',
+              workers=None, chunk_size=20, progress=False, history=None):
+    outcome_columns = (list(outcomes.values()) if outcome_columns is None
+                       else outcome_columns)
+    data = SweepData.from_frame(df, outcome_columns, lags, transforms,
+                                subsamples, top_n, absorb, cluster, history)
+    specs = data.specifications()
+    chunks = [specs[i:i + chunk_size]
+              for i in range(0, len(specs), chunk_size)]
+
+    frames = []
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        _init_worker(data)
+        for chunk in chunks:
+            frames += _fit_chunk(chunk)
+    else:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=(data,)) as pool:
+            futures = [pool.submit(_fit_chunk, chunk) for chunk in chunks]
+            for done, future in enumerate(as_completed(futures), 1):
+                frames += future.result()
+                if progress:
+                    print(f'\r{done}/{len(chunks)} chunks', end='',
+                          file=sys.stderr)
+        if progress:
+            print(file=sys.stderr)
+
+    columns = ['outcome', 'lag', 'transform', 'subsample', 'top_n', 'term',
+               'coef', 'std_err', 't', 'p_value', 'nobs', 'n_clusters']
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    table = pd.concat(frames, ignore_index=True)[columns]
+    table['top_n'] = table['top_n'].astype('Int64')
+
+    return table.sort_values(['outcome', 'lag', 'transform', 'subsample',
+                              'top_n'], ignore_index=True)
+
+
+# sweep stage: the default grid over all regression outcomes on the panel
+# of every institution (panel_all), lags and the top n ranking taken
+# from the whole HERD file
+def get_sweep_results(reg_data, absorb=('year',), cluster='IPEDSID',
+                      lags=default_lags, transforms=default_transforms,
+                      subsamples=default_subsamples, top_n=default_top_n,
+                      fname=herd_file):
+    return run_sweep(reg_data, None, lags, transforms, subsamples, top_n,
+                     absorb, cluster, progress=True,
+                     history=fund_history(fname))
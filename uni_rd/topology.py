@@ -0,0 +1,347 @@
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from uni_rd import instrument
+from uni_rd.config import cache_dir, county_shp, file_signature
+
+# County polygons as a topology: coordinates are snapped to an integer
+# grid, every ring is cut where the set of counties on its edge changes,
+# and each piece of boundary (an arc) is stored once, whichever counties
+# it separates. Rings are lists of arc indices (~i for an arc walked
+# backwards, as in TopoJSON). Arcs are simplified one by one with their
+# end points fixed, so neighbouring counties simplify the same way and
+# the simplified levels keep their shared borders without gaps or
+# overlaps. A ring that a level would flatten to no area gets its arcs
+# back at full resolution (on both sides), so no county disappears. The
+# levels are built once and kept as an npz file.
+
+topology_file = os.path.join(cache_dir, 'county_topology.npz')
+
+# grid cells along the longer side of the bounding box
+quantization = 1000000
+# level -> Douglas-Peucker tolerance in degrees; 0 keeps every point.
+# The end points of the ~9.5k arcs of the 20m county file are always
+# kept, so a level cannot go much below half the points of 'full'
+# (about 350k/305k/255k/205k bytes for these)
+levels = {'full': 0, 'high': 0.01, 'medium': 0.03, 'low': 0.1}
+
+
+class Topology:
+    # geoids: one per county; polygon_offsets (county -> polygons),
+    # ring_offsets (polygon -> rings, the exterior first), arc_offsets
+    # (ring -> entries of ring_arcs); arcs: {level: (offsets, coords)}
+    # with int32 grid coordinates; scale and translate map the grid back
+    # to degrees
+    def __init__(self, geoids, polygon_offsets, ring_offsets, arc_offsets,
+                 ring_arcs, arcs, scale, translate):
+        self.geoids = geoids
+        self.polygon_offsets = polygon_offsets
+        self.ring_offsets = ring_offsets
+        self.arc_offsets = arc_offsets
+        self.ring_arcs = ring_arcs
+        self.arcs = arcs
+        self.scale = scale
+        self.translate = translate
+
+    @property
+    def levels(self):
+        return list(self.arcs)
+
+    # bytes of the arcs of one level (int32 offsets and coordinates)
+    def nbytes(self, level):
+        offsets, coords = self.arcs[level]
+        return offsets.nbytes + coords.nbytes
+
+    # grid coordinates of one ring, arcs joined (shared end points once)
+    def ring_coords(self, level, ring):
+        offsets, coords = self.arcs[level]
+        parts = []
+        for arc in self.ring_arcs[self.arc_offsets[ring]:
+                                  self.arc_offsets[ring + 1]]:
+            index = arc if arc >= 0 else ~arc
+            points = coords[offsets[index]:offsets[index + 1]]
+            points = points if arc >= 0 else points[::-1]
+            parts.append(points if not parts else points[1:])
+
+        return np.concatenate(parts)
+
+    def _rings(self, county):
+        polygons = range(self.polygon_offsets[county],
+                         self.polygon_offsets[county + 1])
+        return [range(self.ring_offsets[p], self.ring_offsets[p + 1])
+                for p in polygons]
+
+    # position of every GEOID in geoids and whether it is there at all
+    def find(self, geoids):
+        return find_sorted(self.geoids, geoids)
+
+    # bokeh patches of the given counties (all by default): exterior
+    # rings in degrees, NaN between the parts of a county; GEOIDs the
+    # topology does not have are skipped, the GEOIDs returned are those
+    # of the patches
+    def patches(self, level='medium', geoids=None, dtype='float32'):
+        if geoids is None:
+            index = np.arange(len(self.geoids))
+        else:
+            index, found = self.find(geoids)
+            index = index[found]
+        xs, ys = [], []
+        for county in index:
+            parts = []
+            for rings in self._rings(county):
+                points = self.ring_coords(level, rings[0])
+                points = points * self.scale + self.translate
+                parts.append(np.vstack([points, [np.nan, np.nan]]))
+            points = np.concatenate(parts)[:-1].astype(dtype)
+            xs.append(points[:, 0])
+            ys.append(points[:, 1])
+
+        return self.geoids[index], xs, ys
+
+    # TopoJSON of one level: delta-encoded integer arcs, one
+    # MultiPolygon per county with its GEOID as id
+    def to_topojson(self, level='medium'):
+        offsets, coords = self.arcs[level]
+        arcs = []
+        for i in range(len(offsets) - 1):
+            points = coords[offsets[i]:offsets[i + 1]].astype('int64')
+            points[1:] = np.diff(points, axis=0)
+            arcs.append(points.tolist())
+
+        geometries = []
+        for county, geoid in enumerate(self.geoids):
+            polygons = [[self.ring_arcs[self.arc_offsets[r]:
+                                        self.arc_offsets[r + 1]].tolist()
+                         for r in rings] for rings in self._rings(county)]
+            geometries.append({'type': 'MultiPolygon', 'id': str(geoid),
+                               'arcs': polygons})
+
+        return {'type': 'Topology',
+                'transform': {'scale': self.scale.tolist(),
+                              'translate': self.translate.tolist()},
+                'objects': {'counties': {'type': 'GeometryCollection',
+                                         'geometries': geometries}},
+                'arcs': arcs}
+
+    def save(self, fname, signature=''):
+        arrays = {f'arcs_{level}': coords
+                  for level, (_, coords) in self.arcs.items()}
+        arrays.update({f'offsets_{level}': offsets
+                       for level, (offsets, _) in self.arcs.items()})
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname + '.tmp', 'wb') as f:
+            np.savez(f, geoids=self.geoids,
+                     polygon_offsets=self.polygon_offsets,
+                     ring_offsets=self.ring_offsets,
+                     arc_offsets=self.arc_offsets, ring_arcs=self.ring_arcs,
+                     scale=self.scale, translate=self.translate,
+                     levels=np.array(self.levels), signature=signature,
+                     **arrays)
+        os.replace(fname + '.tmp', fname)
+
+    @classmethod
+    def load(cls, fname):
+        with np.load(fname) as f:
+            arcs = {str(level): (f[f'offsets_{level}'], f[f'arcs_{level}'])
+                    for level in f['levels']}
+            return cls(f['geoids'], f['polygon_offsets'], f['ring_offsets'],
+                       f['arc_offsets'], f['ring_arcs'], arcs, f['scale'],
+                       f['translate']), str(f['signature'])
+
+
+# rings of every county as grid point ids, consecutive repeats dropped
+def quantized_rings(counties, q=quantization):
+    bounds = counties.total_bounds
+    scale = max(bounds[2] - bounds[0], bounds[3] - bounds[1]) / (q - 1)
+    translate = bounds[:2]
+
+    polygon_offsets = [0]
+    ring_offsets = [0]
+    rings = []
+    for geometry in counties.geometry:
+        parts = getattr(geometry, 'geoms', [geometry])
+        for polygon in parts:
+            for ring in [polygon.exterior, *polygon.interiors]:
+                grid = np.rint((np.asarray(ring.coords)[:-1] - translate)
+                               / scale).astype('int64')
+                keep = np.any(grid != np.roll(grid, 1, axis=0), axis=1)
+                rings.append(grid[keep] if keep.any() else grid[:1])
+            ring_offsets.append(len(rings))
+        polygon_offsets.append(len(ring_offsets) - 1)
+
+    return (rings, np.array(polygon_offsets), np.array(ring_offsets),
+            np.array([scale, scale]), np.asarray(translate, dtype=float))
+
+
+# cut the rings into arcs at the points where the counties on either
+# side change, store every arc once
+def build_arcs(rings):
+    ids = [ring[:, 0] * (quantization + 1) + ring[:, 1] for ring in rings]
+
+    owners = {}
+    point_rings = {}
+    for r, ring in enumerate(ids):
+        for a, b in zip(ring, np.roll(ring, -1)):
+            owners.setdefault((min(a, b), max(a, b)), set()).add(r)
+        for p in set(ring.tolist()):
+            point_rings[p] = point_rings.get(p, 0) + 1
+
+    arcs = []
+    known = {}
+    ring_arcs = []
+    for r, ring in enumerate(ids):
+        n = len(ring)
+        following = np.roll(ring, -1)
+        sides = [frozenset(owners[(min(a, b), max(a, b))])
+                 for a, b in zip(ring, following)]
+        cuts = [i for i in range(n)
+                if sides[i] != sides[i - 1]
+                or point_rings[ring[i]] > len(sides[i] | sides[i - 1])]
+
+        if not cuts:
+            # a ring on its own (island, enclave): one closed arc from its
+            # smallest point, so the same ring of a neighbour matches
+            start = int(np.argmin(ring))
+            order = np.r_[start:n, 0:start + 1]
+            chains = [order]
+        else:
+            chains = [np.arange(start, start + (stop - start) % n
+                                + (n if stop == start else 0) + 1) % n
+                      for start, stop in zip(cuts, cuts[1:] + cuts[:1])]
+
+        entries = []
+        for chain in chains:
+            key = tuple(ring[chain].tolist())
+            if key in known:
+                entries.append(known[key])
+            elif key[::-1] in known:
+                entries.append(~known[key[::-1]])
+            else:
+                known[key] = len(arcs)
+                arcs.append(rings[r][chain])
+                entries.append(known[key])
+        ring_arcs.append(entries)
+
+    return arcs, ring_arcs
+
+
+# positions of values in the sorted array keys, and which were found
+def find_sorted(keys, values):
+    values = np.asarray(values)
+    if not len(keys):
+        return (np.zeros(len(values), dtype='int64'),
+                np.zeros(len(values), dtype=bool))
+    position = np.searchsorted(keys, values)
+    position = np.minimum(position, len(keys) - 1)
+
+    return position, keys[position] == values
+
+
+# twice the area of a ring given as arc entries (shoelace, grid units)
+def ring_area(arcs, entries):
+    parts = []
+    for arc in entries:
+        points = arcs[arc if arc >= 0 else ~arc]
+        points = points if arc >= 0 else points[::-1]
+        parts.append(points if not parts else points[1:])
+    x, y = np.concatenate(parts).astype('float64').T
+
+    return abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+
+# put the full arcs back into every ring a simplified level flattened to
+# no area, until none is left (or the ring is flat at full resolution)
+def restore_collapsed(arcs, simple, ring_arcs):
+    simple = list(simple)
+    while True:
+        restored = False
+        for entries in ring_arcs:
+            if ring_area(simple, entries) > 0:
+                continue
+            for arc in entries:
+                index = arc if arc >= 0 else ~arc
+                if simple[index] is not arcs[index]:
+                    simple[index] = arcs[index]
+                    restored = True
+        if not restored:
+            return simple
+
+
+# simplify every arc with its end points fixed; closed arcs that would
+# collapse keep all their points
+def simplify_arcs(arcs, tolerance):
+    if not tolerance:
+        return arcs
+    lines = shapely.linestrings(np.concatenate(arcs).astype(float),
+                                indices=np.repeat(np.arange(len(arcs)),
+                                                  [len(a) for a in arcs]))
+    simple = shapely.simplify(lines, tolerance, preserve_topology=False)
+    result = []
+    for arc, line in zip(arcs, simple):
+        coords = shapely.get_coordinates(line).astype('int64')
+        closed = (arc[0] == arc[-1]).all()
+        result.append(arc if closed and len(coords) < 4 else coords)
+
+    return result
+
+
+def build_topology(counties, q=quantization, tolerances=None):
+    tolerances = levels if tolerances is None else tolerances
+    counties = counties.sort_values('GEOID')
+    rings, polygon_offsets, ring_offsets, scale, translate = \
+        quantized_rings(counties, q)
+    arcs, ring_arcs = build_arcs(rings)
+
+    simplified = {}
+    for level, tolerance in tolerances.items():
+        level_arcs = restore_collapsed(
+            arcs, simplify_arcs(arcs, tolerance / scale[0]), ring_arcs)
+        offsets = np.zeros(len(level_arcs) + 1, dtype='int32')
+        offsets[1:] = np.cumsum([len(a) for a in level_arcs])
+        simplified[level] = (offsets,
+                             np.concatenate(level_arcs).astype('int32'))
+
+    arc_offsets = np.zeros(len(ring_arcs) + 1, dtype='int64')
+    arc_offsets[1:] = np.cumsum([len(r) for r in ring_arcs])
+
+    return Topology(counties['GEOID'].to_numpy().astype(str),
+                    polygon_offsets, ring_offsets, arc_offsets,
+                    np.concatenate(ring_arcs).astype('int32'), simplified,
+                    scale, translate)
+
+
+# the topology of the county shape file, rebuilt when the file or the
+# levels change
+def get_county_topology(fname=county_shp, rebuild=False):
+    signature = json.dumps([file_signature(fname), quantization, levels])
+    if not rebuild and os.path.exists(topology_file):
+        topology, stored = Topology.load(topology_file)
+        if stored == signature:
+            instrument.count('topology_cache_hits')
+            return topology
+
+    instrument.count('topology_cache_misses')
+    counties = gpd.read_file(fname, columns=['GEOID'], engine='pyogrio')
+    topology = build_topology(counties)
+    topology.save(topology_file, signature)
+
+    return topology
+
+
+# per-year values of one variable in the order of topology.geoids, NaN
+# for counties without data: what goes to the client next to the static
+# geometry instead of one GeoJSON per year
+def year_attributes(df, geoids, variable, dtype='float32'):
+    values = {}
+    for year, group in df.groupby('year'):
+        array = np.full(len(geoids), np.nan, dtype=dtype)
+        position, found = find_sorted(geoids,
+                                      group['COUNTYFIPS'].to_numpy())
+        array[position[found]] = group[variable].to_numpy()[found]
+        values[int(year)] = array
+
+    return values
@@ -0,0 +1,146 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import shapely
+
+from uni_rd import instrument, keys
+from uni_rd.config import cache_dir, county_shp, file_signature, uni_shp
+
+# IPEDSID -> NAME, COUNTYFIPS, lon/lat for every institution, built once
+# from the shape file and kept as an Arrow file next to the other caches
+lookup_file = os.path.join(cache_dir, 'uni_lookup.arrow')
+lookup_columns = ['IPEDSID', 'NAME', 'COUNTYFIPS']
+
+
+# read only the lookup columns (and only the given institutions)
+def read_uni_points(fname=uni_shp, ipedsids=None):
+    where = None
+    if ipedsids is not None:
+        ids = ', '.join("'{}'".format(str(i).replace("'", ''))
+                        for i in ipedsids)
+        where = f'IPEDSID IN ({ids})'
+    uni_us = gpd.read_file(fname, columns=lookup_columns, where=where,
+                           engine='pyogrio')
+    uni_us = uni_us.to_crs('EPSG:4326')
+
+    points = pd.DataFrame({'IPEDSID': uni_us['IPEDSID'].astype(str),
+                           'NAME': uni_us['NAME'],
+                           'COUNTYFIPS': uni_us['COUNTYFIPS'],
+                           'lon': uni_us.geometry.x.to_numpy(),
+                           'lat': uni_us.geometry.y.to_numpy()})
+
+    return points
+
+
+# county GEOID for every (lon, lat), by point-in-polygon on an STRtree of
+# the county shapes; points outside every county get None
+def counties_for_points(lon, lat, fname=county_shp):
+    counties = gpd.read_file(fname, columns=['GEOID'], engine='pyogrio')
+    points = gpd.GeoSeries(gpd.points_from_xy(lon, lat), crs='EPSG:4326')
+    points = points.to_crs(counties.crs).to_numpy()
+
+    tree = shapely.STRtree(counties.geometry.to_numpy())
+    point_idx, county_idx = tree.query(points, predicate='within')
+
+    geoid = np.full(len(points), None, dtype=object)
+    geoid[point_idx] = counties['GEOID'].to_numpy()[county_idx]
+
+    return geoid
+
+
+# fill COUNTYFIPS that are missing or not a current county (e.g. the
+# Connecticut and Alaska changes) from the institution's location
+def resolve_counties(points, fname=county_shp):
+    current = set(gpd.read_file(fname, columns=['GEOID'], engine='pyogrio',
+                                read_geometry=False)['GEOID'])
+    fips = points['COUNTYFIPS'].astype(str).str.zfill(5)
+    stale = (points['COUNTYFIPS'].isna() | ~fips.isin(current)).to_numpy()
+
+    points = points.copy()
+    points['COUNTYFIPS'] = fips.where(points['COUNTYFIPS'].notna(), None)
+    if stale.any():
+        resolved = counties_for_points(points['lon'].to_numpy()[stale],
+                                       points['lat'].to_numpy()[stale],
+                                       fname)
+        fixed = np.where(pd.isna(resolved),
+                         points['COUNTYFIPS'].to_numpy()[stale], resolved)
+        points.loc[stale, 'COUNTYFIPS'] = fixed
+
+    return points
+
+
+def build_uni_lookup(fname=uni_shp, counties=county_shp):
+    points = read_uni_points(fname)
+    points = resolve_counties(points, counties)
+
+    return points.drop_duplicates('IPEDSID').reset_index(drop=True)
+
+
+# the persistent lookup: read from the Arrow file while the shape files are
+# unchanged, otherwise rebuild it and store it again
+def get_uni_lookup(fname=uni_shp, counties=county_shp, rebuild=False):
+    signature = file_signature(fname, counties)
+    if not rebuild and os.path.exists(lookup_file):
+        table = feather.read_table(lookup_file, memory_map=True)
+        stored = (table.schema.metadata or {}).get(b'signature', b'')
+        if stored.decode() == signature:
+            instrument.count('uni_lookup_cache_hits')
+            return table.to_pandas()
+
+    instrument.count('uni_lookup_cache_misses')
+    lookup = build_uni_lookup(fname, counties)
+    table = pa.Table.from_pandas(lookup, preserve_index=False)
+    table = table.replace_schema_metadata({'signature': signature})
+    os.makedirs(os.path.dirname(lookup_file), exist_ok=True)
+    feather.write_feather(table, lookup_file + '.tmp',
+                          compression='uncompressed')
+    os.replace(lookup_file + '.tmp', lookup_file)
+
+    return lookup
+
+
+# IPEDSID, NAME, COUNTYFIPS and lon/lat of every institution in the shape
+# file, it does not depend on which universities are picked
+def get_uni_counties(fname=uni_shp, counties=county_shp):
+    return get_uni_lookup(fname, counties)
+
+
+def get_regression_data(top_uni, df_variables, uni_counties=None):
+    # to get regression data we first to read and match the county level data
+    # with the university data that contains county information
+    if uni_counties is None:
+        uni_counties = get_uni_counties()
+
+    # filter university based on the lis of top universities
+    uni_filter = uni_counties.loc[uni_counties['IPEDSID']
+                                  .isin(top_uni['IPEDSID'])]
+    uni_filter = uni_filter[['IPEDSID', 'NAME', 'COUNTYFIPS']]
+
+    # university fund
+    # matched university fund data with the population and income data
+    # in that county; both joins are on packed int64 keys (IPEDSID, then
+    # year and FIPS), the county also has to be in the institution's state
+    reg_data = keys.join(top_uni, uni_filter,
+                         keys.frame_key(top_uni, 'IPEDSID', None),
+                         keys.frame_key(uni_filter, 'IPEDSID', None),
+                         shared=['IPEDSID'])
+
+    reg_data['year'] = reg_data['year'].astype('int')
+
+    # merge with data frame of income and population
+    reg_data = keys.join(reg_data, df_variables, keys.frame_key(reg_data),
+                         keys.frame_key(df_variables), equal=['state'],
+                         shared=['year', 'COUNTYFIPS'])
+
+    reg_data = reg_data[['year', 'IPEDSID', 'COUNTYFIPS', 'fund',
+                         'income_past12m', 'total_population',
+                         'total_born_out_state',
+                         'total_foreign_born']].copy()
+
+    reg_data['fund'] = reg_data['fund'].astype(float)
+
+    return reg_data